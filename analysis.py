@@ -0,0 +1,199 @@
+from datetime import datetime, timezone
+import json
+from pathlib import Path
+import sys
+from typing import Any, Dict, List, Optional, Tuple
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from histogram import SUB_BUCKET_BITS, SUB_BUCKET_COUNT, SUB_BUCKET_HALF, Histogram
+from histogram_file import LABELS
+from results import COLUMNS, META_FILE
+
+# Vectorized analysis of columnar results directories (run_vegeta.py --results columns). The
+# columns are memory-mapped and read a chunk at a time, and each chunk is grouped with one
+# sort and folded into per-group latency histograms, so memory stays bounded however large the
+# campaign is. Percentiles come out of the same histograms as everywhere else.
+TIME_UNITS = {"second": 1, "minute": 60, "hour": 3600}
+GROUPS = LABELS + ["status"] + list(TIME_UNITS)
+# Groups that vary from request to request. The others are labels, the same for a whole run.
+ROW_GROUPS = ["stage", "status"] + list(TIME_UNITS)
+CHUNK_ROWS = 1 << 22
+
+
+def require_numpy() -> None:
+    if np is None:
+        raise Exception("Analyzing columnar results needs the `numpy` package. Install it with `pip install numpy`")
+
+
+def bucket_indices(values: "np.ndarray") -> "np.ndarray":
+    # histogram.bucket_index over an array
+    values = values.astype(np.int64)
+    _, bit_length = np.frexp(values.astype(np.float64))
+    shift = np.maximum(bit_length - SUB_BUCKET_BITS, 1)
+    large = SUB_BUCKET_COUNT + (shift - 1) * SUB_BUCKET_HALF + (values >> shift) - SUB_BUCKET_HALF
+    return np.where(values < SUB_BUCKET_COUNT, values, large)
+
+
+def _open_column(path: Path) -> "np.ndarray":
+    # Memory-maps a column, sized by the file rather than its header: a run that was killed
+    # leaves the rows it flushed after a header that doesn't count them
+    with open(path, "rb") as f:
+        np.lib.format.read_magic(f)
+        _, _, dtype = np.lib.format.read_array_header_1_0(f)
+        offset = f.tell()
+    rows = (path.stat().st_size - offset) // dtype.itemsize
+    if rows == 0:
+        return np.empty(0, dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode="r", offset=offset, shape=(rows,))
+
+
+class _Group:
+    def __init__(self):
+        self.latencies = Histogram()
+        self.success = 0
+        self.bytes_in = 0
+        self.first: Optional[int] = None  # send times, ns since the epoch
+        self.last = 0
+
+
+class Run:
+    # One results directory: its labels, and its columns memory-mapped
+    def __init__(self, path: Path, include_warmup: bool = False):
+        self.path = path
+        meta = json.loads((path / META_FILE).read_text(encoding="utf-8"))
+        self.labels: Dict[str, str] = {**meta["labels"], "run": meta["run"]}
+        self.stages: List[str] = meta["stages"]
+        # Per stage, the send time its detected warmup (left out unless include_warmup) ends at
+        ends = None if include_warmup else meta.get("warmup_end")
+        self.warmup_end = None if ends is None else np.array([end or 0 for end in ends], dtype=np.int64)
+        self.columns = {name: _open_column(path / f"{name}.npy") for name in COLUMNS}
+        self.rows = min(len(column) for column in self.columns.values())
+        header_rows = np.load(path / "timestamp.npy", mmap_mode="r").shape[0]
+        if self.rows != header_rows:
+            print(f"{path}: reading the {self.rows} complete rows of a run that didn't finish writing", file=sys.stderr)
+
+
+class Campaign:
+    def __init__(self, runs: List[Run]):
+        self.runs = runs
+
+    @staticmethod
+    def load(paths: List[Path], include_warmup: bool = False) -> "Campaign":
+        require_numpy()
+        return Campaign([Run(path, include_warmup) for path in paths])
+
+    def summarize(
+        self, by: List[str], quantiles: List[float], filters: Optional[Dict[str, str]] = None
+    ) -> List[Tuple[Tuple[str, ...], Dict[str, Any]]]:
+        # Percentiles, throughput and error rate per group, sorted by group. filters keeps
+        # only the requests whose labels have the given values.
+        filters = filters or {}
+        groups: Dict[Tuple, _Group] = {}
+        for run in self.runs:
+            if any(run.labels.get(label, "") != value for label, value in filters.items() if label != "stage"):
+                continue
+            for start in range(0, run.rows, CHUNK_ROWS):
+                self._add_chunk(groups, run, start, min(start + CHUNK_ROWS, run.rows), by, filters.get("stage"))
+
+        units = [TIME_UNITS[group] for group in by if group in TIME_UNITS]
+        summary = []
+        for key in sorted(groups):
+            group = groups[key]
+            total = group.latencies.total
+            # A group that is a time interval lasts the interval, however its sends fell
+            # within it. Rates of a single instant are reported as 0, like merge_histograms.py.
+            duration = float(min(units)) if units else (group.last - group.first) / 1e9
+            stats = {
+                "requests": total,
+                "rate": total / duration if duration > 0 else 0.0,
+                "throughput": group.success / duration if duration > 0 else 0.0,
+                "errors": 1 - group.success / total,
+                "max": group.latencies.max,
+                "bytes_in": group.bytes_in / total,
+            }
+            for q, value in zip(quantiles, group.latencies.percentiles(quantiles)):
+                stats[f"p{q:g}"] = value
+            summary.append((tuple(self._name(name, value) for name, value in zip(by, key)), stats))
+        return summary
+
+    def _add_chunk(
+        self, groups: Dict[Tuple, _Group], run: Run, start: int, end: int, by: List[str], stage: Optional[str]
+    ) -> None:
+        columns = {name: np.asarray(column[start:end]) for name, column in run.columns.items()}
+        if run.warmup_end is not None:
+            mask = columns["timestamp"] >= run.warmup_end[columns["stage"]]
+            columns = {name: column[mask] for name, column in columns.items()}
+        if stage is not None:
+            mask = columns["stage"] == (run.stages.index(stage) if stage in run.stages else -1)
+            columns = {name: column[mask] for name, column in columns.items()}
+        if len(columns["timestamp"]) == 0:
+            return
+        row_keys = []
+        for name in by:
+            if name in TIME_UNITS:
+                row_keys.append(columns["timestamp"] // (TIME_UNITS[name] * 10**9))
+            elif name in ROW_GROUPS:
+                row_keys.append(columns[name].astype(np.int64))
+        if row_keys:
+            unique, inverse = np.unique(np.stack(row_keys, axis=1), axis=0, return_inverse=True)
+            inverse = inverse.reshape(-1)
+        else:
+            unique, inverse = np.zeros((1, 0), dtype=np.int64), np.zeros(len(columns["timestamp"]), dtype=np.int64)
+        count = len(unique)
+
+        latency = columns["latency"].astype(np.int64)
+        status = columns["status"]
+        success = np.bincount(inverse, weights=(status >= 200) & (status < 400), minlength=count)
+        bytes_in = np.bincount(inverse, weights=columns["bytes_in"], minlength=count)
+        order = np.argsort(inverse, kind="stable")
+        starts = np.searchsorted(inverse[order], np.arange(count))
+        sorted_latency = latency[order]
+        sorted_timestamp = columns["timestamp"][order]
+        first = np.minimum.reduceat(sorted_timestamp, starts)
+        last = np.maximum.reduceat(sorted_timestamp, starts)
+        low = np.minimum.reduceat(sorted_latency, starts)
+        high = np.maximum.reduceat(sorted_latency, starts)
+        total = np.add.reduceat(sorted_latency, starts)
+        # Bucket counts of every group at once: one code per (group, bucket) pair
+        codes, bucket_counts = np.unique(inverse * (1 << 32) + bucket_indices(latency), return_counts=True)
+
+        keys = []
+        for i in range(count):
+            row_values = iter(unique[i])
+            key = []
+            for name in by:
+                if name == "stage":
+                    key.append(run.stages[next(row_values)] if run.stages else "")
+                elif name in ROW_GROUPS:
+                    key.append(int(next(row_values)))
+                else:
+                    key.append(run.labels.get(name, ""))
+            keys.append(tuple(key))
+            group = groups.get(keys[-1])
+            if group is None:
+                group = groups[keys[-1]] = _Group()
+            hist = group.latencies
+            if hist.total == 0 or low[i] < hist.min:
+                hist.min = int(low[i])
+            hist.max = max(hist.max, int(high[i]))
+            hist.sum += int(total[i])
+            group.success += int(success[i])
+            group.bytes_in += int(bytes_in[i])
+            group.first = int(first[i]) if group.first is None else min(group.first, int(first[i]))
+            group.last = max(group.last, int(last[i]))
+        for code, bucket_count in zip(codes.tolist(), bucket_counts.tolist()):
+            hist = groups[keys[code >> 32]].latencies
+            index = code & 0xFFFFFFFF
+            hist.counts[index] = hist.counts.get(index, 0) + bucket_count
+            hist.total += bucket_count
+
+    @staticmethod
+    def _name(group: str, value: Any) -> str:
+        if group in TIME_UNITS:
+            when = datetime.fromtimestamp(value * TIME_UNITS[group], timezone.utc)
+            return when.strftime("%H:%M:%S" if group == "second" else "%Y-%m-%d %H:%M")
+        return str(value)
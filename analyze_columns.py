@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+import argparse
+from pathlib import Path
+
+from analysis import GROUPS, LABELS, Campaign
+from load_engine import fmt_duration
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Slice the columnar results of any number of runs (`run_vegeta.py --results columns`) by service, phase, time and more, with vectorized percentiles",
+    )
+    parser.add_argument("dirs", type=Path, nargs="+", help="Results directories (.columns), e.g. vegeta_out/*.columns")
+    parser.add_argument(
+        "--by",
+        type=str,
+        help=f"Comma-separated groups, out of {', '.join(GROUPS)} (empty for a single total)",
+        default="service,minute",
+    )
+    parser.add_argument("--quantiles", type=str, help="Comma-separated latency percentiles to report", default="50,90,99,99.9")
+    for label in LABELS:
+        parser.add_argument(f"--{label}", type=str, help=f"Only analyze requests with this {label}", default=None)
+    parser.add_argument(
+        "--include-warmup",
+        help="Keep the requests sent during a warmup detected by `--warmup auto`, which are left out by default",
+        action="store_true",
+        default=False,
+    )
+    args = parser.parse_args()
+    by = [group.strip() for group in args.by.split(",") if group.strip()]
+    for group in by:
+        if group not in GROUPS:
+            raise Exception(f"Unknown group '{group}', expected one of {GROUPS}")
+    quantiles = [float(q) for q in args.quantiles.split(",")]
+
+    campaign = Campaign.load(args.dirs, args.include_warmup)
+    filters = {label: getattr(args, label) for label in LABELS if getattr(args, label) is not None}
+    rows = []
+    for name, stats in campaign.summarize(by, quantiles, filters):
+        rows.append([
+            " ".join(value for value in name if value) or "All",
+            str(stats["requests"]),
+            f"{stats['rate']:.2f}",
+            f"{stats['throughput']:.2f}",
+            *(fmt_duration(stats[f"p{q:g}"] / 1e6) for q in quantiles),
+            fmt_duration(stats["max"] / 1e6),
+            f"{100 * stats['errors']:.2f}%",
+        ])
+    header = [" ".join(by) or "Group", "Requests", "Rate", "Throughput", *(f"p{q:g}" for q in quantiles), "max", "Errors"]
+    width = max(len(line[0]) for line in [header] + rows)
+    for line in [header] + rows:
+        print(f"{line[0]:<{width}}  " + "  ".join(f"{value:>10}" for value in line[1:]))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,39 @@
+#!/usr/bin/env python3
+import argparse
+from pathlib import Path
+
+from load_profile import parse_duration
+from results import ResultSummary, merge_results
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Summarize raw results saved by `run_vegeta.py --results`, streaming them so that any number fit in memory",
+    )
+    parser.add_argument(
+        "files",
+        type=Path,
+        nargs="+",
+        help="Results files: .results from the asyncio engine (one per worker), .bin from vegeta (needs vegeta to decode) or vegeta's CSV",
+    )
+    parser.add_argument(
+        "--every",
+        type=str,
+        help="Interval of the over-time breakdown, e.g. 1s or 1m (0 to leave it out)",
+        default="1s",
+    )
+    parser.add_argument(
+        "--include-warmup",
+        help="Keep the requests sent during a warmup detected by `--warmup auto`, which are left out by default",
+        action="store_true",
+        default=False,
+    )
+    args = parser.parse_args()
+    summary = ResultSummary(parse_duration(args.every))
+    for result in merge_results(args.files, args.include_warmup):
+        summary.add(result)
+    print(summary.report(), end="")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,48 @@
+from dataclasses import dataclass
+import random
+from typing import Iterator
+
+ARRIVALS = ["constant", "poisson", "burst"]
+
+
+@dataclass
+class ArrivalProcess:
+    kind: str = "constant"
+    burst_size: int = 10  # burst only: requests that arrive together
+    seed: int = 0
+
+    def positions(self, total: int, shard: int = 0, shards: int = 1) -> Iterator[float]:
+        # Arrival positions on a load profile's cumulative request count axis, in [0, total).
+        # Mapping them through Profile.locate gives send times that follow the profile's rate,
+        # with the spacing between requests drawn from this process. With shards, these are the
+        # positions of one shard's share: each shard draws only its own, and together they add
+        # up to the same process at the full rate. Every shards-th position for constant
+        # spacing; for the other two, independent streams at 1/shards of the rate, since
+        # superposed Poisson (and batch Poisson) processes are again Poisson.
+        rng = random.Random(self.seed if shards == 1 else f"{self.seed}/{shard}")
+        if self.kind == "constant":
+            yield from range(shard, total, shards)
+        elif self.kind == "poisson":
+            # Exponential gaps: a Poisson process with the profile's (possibly varying) rate
+            position = 0.0 if shard == 0 else rng.expovariate(1.0 / shards)
+            while position < total:
+                yield position
+                position += rng.expovariate(1.0 / shards)
+        elif self.kind == "burst":
+            # Batch Poisson: bursts of burst_size requests sent at once, with exponential gaps
+            # between bursts so that the mean rate still matches the profile
+            gap = self.burst_size * shards
+            position = 0.0 if shard == 0 else gap * rng.expovariate(1.0)
+            while position < total:
+                for _ in range(self.burst_size):
+                    yield position
+                position += gap * rng.expovariate(1.0)
+        else:
+            raise Exception(f"Unknown arrival process '{self.kind}', expected one of {ARRIVALS}")
+
+    def describe(self) -> str:
+        if self.kind == "constant":
+            return "constant"
+        if self.kind == "burst":
+            return f"burst of {self.burst_size}, seed {self.seed}"
+        return f"{self.kind}, seed {self.seed}"
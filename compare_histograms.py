@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+import argparse
+from pathlib import Path
+import sys
+from typing import List, Optional
+
+from histogram import quantile_test
+from histogram_file import LABELS, HistogramRecord, merge_records, read_histogram_file
+from load_engine import fmt_duration
+
+
+def change(baseline: int, candidate: int) -> float:
+    # Percent change of a percentile
+    return 100 * (candidate - baseline) / baseline if baseline else 0.0
+
+
+def compare(name: str, baseline: Optional[HistogramRecord], candidate: Optional[HistogramRecord], args) -> List[str]:
+    if baseline is None or candidate is None:
+        return [name] + [""] * 8 + ["only in " + ("candidate" if baseline is None else "baseline")]
+    base = baseline.corrected if args.corrected else baseline.latencies
+    cand = candidate.corrected if args.corrected else candidate.latencies
+    base_p50, base_p99 = base.percentiles([50, 99])
+    cand_p50, cand_p99 = cand.percentiles([50, 99])
+    # Each percentile is gated on its own test, so that a regression in the tail alone counts
+    p50_value, p99_value = quantile_test(base, cand, 50), quantile_test(base, cand, 99)
+    exceeded = [(change(base_p50, cand_p50) > args.p50, p50_value), (change(base_p99, cand_p99) > args.p99, p99_value)]
+    if any(over and p_value < args.alpha for over, p_value in exceeded):
+        verdict = "REGRESSED"
+    elif any(over for over, _ in exceeded):
+        verdict = "ok (not significant)"
+    else:
+        verdict = "ok"
+    return [
+        name,
+        fmt_duration(base_p50 / 1e6),
+        fmt_duration(cand_p50 / 1e6),
+        f"{change(base_p50, cand_p50):+.1f}%",
+        f"{p50_value:.2g}",
+        fmt_duration(base_p99 / 1e6),
+        fmt_duration(cand_p99 / 1e6),
+        f"{change(base_p99, cand_p99):+.1f}%",
+        f"{p99_value:.2g}",
+        verdict,
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Compare a candidate set of runs against a baseline, e.g. before and after a feature server upgrade. "
+        "Exits with 1 if any group's p50 or p99 regressed past its threshold, significantly by a test of that percentile",
+    )
+    parser.add_argument("--baseline", type=Path, nargs="+", required=True, help="Baseline .hist files, e.g. kept from a known-good run")
+    parser.add_argument("--candidate", type=Path, nargs="+", required=True, help="Candidate .hist files")
+    parser.add_argument(
+        "--by",
+        type=str,
+        help=f"Comma-separated labels to match baseline and candidate runs by, out of {', '.join(LABELS)}",
+        default="service",
+    )
+    parser.add_argument("--phase", type=str, help="Comma-separated phases to compare, leaving out the others (e.g. warmup)", default="load,replay")
+    parser.add_argument("--p50", type=float, help="Largest allowed p50 increase, in percent", default=10.0)
+    parser.add_argument("--p99", type=float, help="Largest allowed p99 increase, in percent", default=20.0)
+    parser.add_argument("--alpha", type=float, help="Significance level an increase must reach to count as a regression", default=0.01)
+    parser.add_argument("--corrected", help="Compare latencies corrected for coordinated omission", action="store_true", default=False)
+    args = parser.parse_args()
+    by = [label.strip() for label in args.by.split(",") if label.strip()]
+    for label in by:
+        if label not in LABELS:
+            raise Exception(f"Unknown label '{label}', expected one of {LABELS}")
+    phases = {phase.strip() for phase in args.phase.split(",")}
+
+    def load(paths: List[Path]):
+        records = [record for path in paths for record in read_histogram_file(path)]
+        return merge_records((record for record in records if record.labels.get("phase") in phases), by)
+
+    baseline, candidate = load(args.baseline), load(args.candidate)
+    rows = [
+        compare(" ".join(value for value in key if value) or "All", baseline.get(key), candidate.get(key), args)
+        for key in sorted(set(baseline) | set(candidate))
+    ]
+    header = [" ".join(by) or "Group", "p50 base", "p50 cand", "change", "p", "p99 base", "p99 cand", "change", "p", "Verdict"]
+    width = max(len(line[0]) for line in [header] + rows)
+    for line in [header] + rows:
+        print(f"{line[0]:<{width}}  " + "  ".join(f"{value:>10}" for value in line[1:-1]) + f"  {line[-1]}")
+    # Groups run on only one side count as failures too, so that a missing run can't pass the gate
+    failed = [line for line in rows if line[-1] == "REGRESSED" or line[-1].startswith("only in")]
+    if failed:
+        print(f"\n{len(failed)} of {len(rows)} groups failed")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,309 @@
+from abc import ABC, abstractmethod
+from array import array
+from base64 import b64decode
+from dataclasses import dataclass
+import json
+from pathlib import Path
+import sys
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Tuple, Union
+from urllib.parse import urlsplit
+
+from keyspace import KeySampler
+from target_file import BodyTemplate, TargetFile, is_target_file
+
+USER_AGENT = "benchmark-selfserve"
+MAX_DIGITS = 20  # of a uint64, the most a rendered join-key value or length can take
+
+
+@dataclass
+class Target:
+    method: str
+    url: str
+    body: bytes
+    headers: Dict[str, str]
+
+
+def iter_targets(req_file: Path) -> Iterator[Target]:
+    # Same JSON-lines format that `vegeta attack --format=json` reads
+    with open(req_file, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            raw = json.loads(line)
+            headers = {
+                name: value[0] if isinstance(value, list) else value
+                for name, value in (raw.get("header") or {}).items()
+            }
+            yield Target(
+                method=raw.get("method", "GET"),
+                url=raw["url"],
+                body=b64decode(raw.get("body") or ""),
+                headers=headers,
+            )
+
+
+def endpoint(url: str) -> Tuple[str, str, int, str]:
+    parts = urlsplit(url)
+    scheme = parts.scheme or "http"
+    port = parts.port or (443 if scheme == "https" else 80)
+    path = parts.path or "/"
+    if parts.query:
+        path += "?" + parts.query
+    return scheme, parts.hostname, port, path
+
+
+def count_keys(body: bytes) -> int:
+    # Join keys a get-features request looks up: the batch size for get-features-batch, else 1
+    try:
+        params = json.loads(body).get("params") or {}
+    except (ValueError, AttributeError):
+        return 1
+    return len(params.get("request_data") or [None])
+
+
+@dataclass
+class Origin:
+    # Everything requests to the same method + URL + headers have in common
+    method: str
+    url: str
+    scheme: str
+    host: str
+    port: int
+    path: str
+    headers: Dict[str, str]
+
+    @property
+    def authority(self) -> str:
+        return self.host if self.port in (80, 443) else f"{self.host}:{self.port}"
+
+    def http1_head(self) -> bytes:
+        # Request line and headers up to, but excluding, the per-request Content-Length
+        lines = [
+            f"{self.method} {self.path} HTTP/1.1",
+            f"Host: {self.authority}",
+            f"User-Agent: {USER_AGENT}",
+        ]
+        lines += [f"{name}: {value}" for name, value in self.headers.items()]
+        return ("\r\n".join(lines) + "\r\n").encode("latin-1")
+
+
+class Corpus:
+    # A service's requests, decoded once at load and pre-encoded as complete HTTP/1.1 messages
+    # packed back to back in a single buffer. Sending request i is a memoryview slice of that
+    # buffer: no JSON or base64 decoding, and no copying, per request.
+    def __init__(
+        self,
+        buffer: bytearray,
+        starts: array,
+        body_starts: array,
+        origin_ids: array,
+        origins: List[Origin],
+        keys_per_request: int = 1,
+    ):
+        self._buffer = buffer
+        self._view = memoryview(buffer)
+        self._starts = starts  # len(self) + 1 entries, the last one is the end of the buffer
+        self._body_starts = body_starts
+        self.origin_ids = origin_ids
+        self.origins = origins
+        self.keys_per_request = keys_per_request
+
+    @staticmethod
+    def build(targets: Iterable[Target], headers: Dict[str, str]) -> "Corpus":
+        buffer = bytearray()
+        starts = array("Q")
+        body_starts = array("Q")
+        origin_ids = array("I")
+        origins: List[Origin] = []
+        heads: List[bytes] = []
+        index: Dict[Tuple, int] = {}
+        for target in targets:
+            key = (target.method, target.url, tuple(target.headers.items()))
+            origin_id = index.get(key)
+            if origin_id is None:
+                scheme, host, port, path = endpoint(target.url)
+                origin = Origin(target.method, target.url, scheme, host, port, path, {**target.headers, **headers})
+                origin_id = index[key] = len(origins)
+                origins.append(origin)
+                heads.append(origin.http1_head())
+            starts.append(len(buffer))
+            buffer += heads[origin_id]
+            buffer += b"Content-Length: %d\r\n\r\n" % len(target.body)
+            body_starts.append(len(buffer))
+            buffer += target.body
+            origin_ids.append(origin_id)
+        starts.append(len(buffer))
+        corpus = Corpus(buffer, starts, body_starts, origin_ids, origins)
+        if len(corpus):
+            # Generated files use one batch size throughout, so the first request tells
+            corpus.keys_per_request = count_keys(bytes(corpus.body(0)))
+        return corpus
+
+    def __len__(self) -> int:
+        return len(self.origin_ids)
+
+    def message(self, index: int) -> memoryview:
+        return self._view[self._starts[index]:self._starts[index + 1]]
+
+    def request(self, index: int, buffer: Optional[bytearray] = None) -> Tuple[memoryview, int]:
+        # The HTTP/1.1 message and its body length. Nothing to render, so buffer goes unused.
+        return self.message(index), self.body_len(index)
+
+    def body(self, index: int) -> memoryview:
+        return self._view[self._body_starts[index]:self._starts[index + 1]]
+
+    def body_len(self, index: int) -> int:
+        return self._starts[index + 1] - self._body_starts[index]
+
+    def origin_id(self, index: int) -> int:
+        return self.origin_ids[index]
+
+    def origin(self, index: int) -> Origin:
+        return self.origins[self.origin_ids[index]]
+
+    def shard(self, shard: int, shards: int) -> "Corpus":
+        # Every shards-th request, starting at shard, copied into a buffer of its own
+        buffer = bytearray()
+        starts = array("Q")
+        body_starts = array("Q")
+        origin_ids = array("I")
+        for index in range(shard, len(self), shards):
+            starts.append(len(buffer))
+            body_starts.append(len(buffer) + self._body_starts[index] - self._starts[index])
+            buffer += self.message(index)
+            origin_ids.append(self.origin_ids[index])
+        starts.append(len(buffer))
+        return Corpus(buffer, starts, body_starts, origin_ids, self.origins, self.keys_per_request)
+
+    def __getstate__(self) -> dict:
+        state = self.__dict__.copy()
+        del state["_view"]
+        return state
+
+    def __setstate__(self, state: dict) -> None:
+        self.__dict__.update(state)
+        self._view = memoryview(self._buffer)
+
+
+class TemplateCorpus(ABC):
+    # Same interface as Corpus, but request i is rendered when it's sent, from a body template
+    # and the join-key values the subclass looks up or draws for it, so nothing is held per
+    # request
+    def __init__(self, origin: Origin, template: BodyTemplate, keys_per_request: int = 1):
+        self.origins = [origin]
+        self._head = origin.http1_head()
+        self._template = template
+        self._parts = template.parts[1:]
+        # Messages are rendered with the body at a fixed offset, past room for the head with
+        # the longest Content-Length, so that a buffer sized once fits every request
+        self._body_offset = len(self._head) + len(b"Content-Length: \r\n\r\n") + MAX_DIGITS
+        self._max_size = self._body_offset + sum(len(part) for part in template.parts) + template.slots * MAX_DIGITS
+        self.keys_per_request = keys_per_request
+
+    @abstractmethod
+    def __len__(self) -> int:
+        ...
+
+    @abstractmethod
+    def _values(self, index: int) -> Sequence[int]:
+        ...
+
+    def origin_id(self, index: int) -> int:
+        return 0
+
+    def origin(self, index: int) -> Origin:
+        return self.origins[0]
+
+    def body(self, index: int) -> bytes:
+        return self._template.render(self._values(index))
+
+    def body_len(self, index: int) -> int:
+        return len(self.body(index))
+
+    def request(self, index: int, buffer: Optional[bytearray] = None) -> Tuple[memoryview, int]:
+        # Rendered into buffer, which the caller reuses for its next request once this one's
+        # response has arrived: by then the transport no longer holds on to the bytes. The body
+        # is spliced in at its fixed offset first, then the head is written right in front of
+        # it, so the digits of each value are all that's built per request.
+        if buffer is None:
+            buffer = bytearray()
+        if len(buffer) < self._max_size:
+            buffer.extend(bytes(self._max_size - len(buffer)))
+        first = self._template.parts[0]
+        pos = self._body_offset + len(first)
+        buffer[self._body_offset:pos] = first
+        for value, part in zip(self._values(index), self._parts):
+            digits = b"%d" % value
+            end = pos + len(digits)
+            buffer[pos:end] = digits
+            pos = end + len(part)
+            buffer[end:pos] = part
+        body_len = pos - self._body_offset
+        length = b"Content-Length: %d\r\n\r\n" % body_len
+        start = self._body_offset - len(length) - len(self._head)
+        buffer[start:start + len(self._head)] = self._head
+        buffer[self._body_offset - len(length):self._body_offset] = length
+        return memoryview(buffer)[start:pos], body_len
+
+
+class SynthesizedCorpus(TemplateCorpus):
+    # No request file: the key tuples of request i are drawn by a KeySampler. Memory stays
+    # constant however many distinct keys a run exercises.
+    def __init__(self, origin: Origin, template: BodyTemplate, sampler: KeySampler, keys_per_request: int = 1):
+        super().__init__(origin, template, keys_per_request)
+        self._sampler = sampler
+
+    def __len__(self) -> int:
+        # A sequential sweep repeats after the whole key space, random draws never repeat by index
+        if self._sampler.distribution.kind == "sequential":
+            return self._sampler.key_space.size
+        return sys.maxsize
+
+    def _values(self, index: int) -> List[int]:
+        values = []
+        for key_index in range(index * self.keys_per_request, (index + 1) * self.keys_per_request):
+            values.extend(self._sampler(key_index))
+        return values
+
+    def shard(self, shard: int, shards: int) -> "SynthesizedCorpus":
+        raise Exception("A synthesized corpus can't be partitioned: every worker draws from the same key sequence")
+
+
+class TargetCorpus(TemplateCorpus):
+    # A binary target file (target_file.py), left memory-mapped: request i's values are read
+    # from the map when it's sent. Shards are strided views of the same file.
+    def __init__(self, path: Path, headers: Dict[str, str], start: int = 0, step: int = 1):
+        self._path = path
+        self._headers = headers
+        self._start = start
+        self._step = step
+        self._target_file = TargetFile(path)
+        target_file = self._target_file
+        scheme, host, port, url_path = endpoint(target_file.url)
+        origin = Origin(target_file.method, target_file.url, scheme, host, port, url_path, dict(headers))
+        super().__init__(origin, target_file.template, target_file.keys_per_request)
+
+    def __len__(self) -> int:
+        return len(range(self._start, len(self._target_file), self._step))
+
+    def _values(self, index: int) -> memoryview:
+        return self._target_file.key_values(self._start + index * self._step)
+
+    def shard(self, shard: int, shards: int) -> "TargetCorpus":
+        return TargetCorpus(self._path, self._headers, self._start + shard * self._step, self._step * shards)
+
+    def __getstate__(self) -> dict:
+        # The map doesn't pickle: workers open the file again
+        return {"path": self._path, "headers": self._headers, "start": self._start, "step": self._step}
+
+    def __setstate__(self, state: dict) -> None:
+        self.__init__(state["path"], state["headers"], state["start"], state["step"])
+
+
+def load_corpus(req_file: Path, headers: Dict[str, str]) -> Union[Corpus, TargetCorpus]:
+    # Either a JSON-lines request file or a binary target file (target_file.py)
+    corpus = TargetCorpus(req_file, headers) if is_target_file(req_file) else Corpus.build(iter_targets(req_file), headers)
+    if len(corpus) == 0:
+        raise Exception(f"No targets in {req_file}")
+    return corpus
@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+import argparse
+from dataclasses import asdict, dataclass
+import json
+import os
+import time
+from typing import List, Optional, Union
+
+from gen_requests import REQS_DIR, request_file_names
+from corpus import Corpus, TargetCorpus, load_corpus
+from load_engine import AttackStats, Load, PoolConfig, request_headers, run_attack
+from load_profile import Profile, Stage
+from manifest import load_manifest
+from run_vegeta import HTTP_VERSIONS, VEGET_OUT_FOLDERNAME, VEGETA_OUT_DIR, ReqUtil
+
+CAPACITY_FILENAME = "capacity.json"
+
+
+@dataclass
+class Trial:
+    rps: int
+    achieved_rps: float
+    p50_ms: float
+    p99_ms: float
+    error_rate: float
+    passed: bool
+
+
+class CapacitySearch:
+    def __init__(self, corpus: Union[Corpus, TargetCorpus], pool_config: PoolConfig, args: argparse.Namespace):
+        self._corpus = corpus
+        self._args = args
+        self._pool_config = pool_config
+        self.curve: List[Trial] = []
+
+    def _trial(self, rps: int) -> Trial:
+        if self.curve:
+            time.sleep(self._args.cooldown)
+        # A short warmup stage at the trial rate, then the measured stage
+        profile = Profile([
+            Stage("warmup", self._args.trial_warmup, rps, rps),
+            Stage("measure", self._args.trial_duration, rps, rps),
+        ])
+        with open(os.devnull, "w") as devnull:
+            stages = run_attack(
+                self._corpus,
+                Load(profile.duration, profile=profile),
+                self._args.timeout / 1000,
+                self._args.max_workers,
+                self._pool_config,
+                devnull,
+                self._args.workers,
+            )
+        trial = self._judge(rps, stages[-1])
+        self.curve.append(trial)
+        verdict = "ok" if trial.passed else "FAIL"
+        print(
+            f"  {rps:>7} RPS: achieved {trial.achieved_rps:.1f}, p50 {trial.p50_ms:.2f}ms, "
+            f"p99 {trial.p99_ms:.2f}ms, errors {100 * trial.error_rate:.2f}%  {verdict}"
+        )
+        return trial
+
+    def _judge(self, rps: int, stats: AttackStats) -> Trial:
+        total = stats.latencies.total
+        attack = stats.last_sent - stats.first_sent if total else 0.0
+        achieved = total / attack if attack > 0 else 0.0
+        # Judge on the coordinated-omission-corrected latencies, so a driver that falls behind
+        # can't make an overloaded service look healthy
+        p50, p99 = stats.corrected.percentiles([50, 99])
+        error_rate = 1 - stats.success / total if total else 1.0
+        passed = (
+            total > 0
+            and p99 / 1000 <= self._args.p99
+            and error_rate <= self._args.max_error_rate / 100
+            and achieved >= rps * self._args.min_achieved / 100
+        )
+        return Trial(rps, achieved, p50 / 1000, p99 / 1000, error_rate, passed)
+
+    def run(self) -> Optional[int]:
+        # Step up geometrically until the SLO breaks, then bisect between the last passing
+        # and the first failing rate
+        low = None
+        rps = min(self._args.start_rps, self._args.max_rps)
+        while True:
+            if not self._trial(rps).passed:
+                high = rps
+                break
+            low = rps
+            if rps >= self._args.max_rps:
+                return rps
+            rps = min(int(rps * self._args.step_factor), self._args.max_rps)
+        if low is None:
+            return None
+        while (high - low) / low > self._args.precision / 100 and high - low > 1:
+            mid = (low + high) // 2
+            if self._trial(mid).passed:
+                low = mid
+            else:
+                high = mid
+        return low
+
+
+def main():
+    REQS_DIR.mkdir(parents=True, exist_ok=True)
+    req_filenames = request_file_names()
+
+    parser = argparse.ArgumentParser(
+        description="Find the highest RPS each feature service sustains within a latency and error-rate SLO"
+    )
+    parser.add_argument("-s", "--service", type=str, help="Feature Service(s) to search (default: all)", nargs="*", default=None)
+    parser.add_argument("--p99", type=float, help="SLO: p99 latency (in miliseconds)", default=100)
+    parser.add_argument("--max-error-rate", type=float, help="SLO: maximum share of failed requests (in percent)", default=1)
+    parser.add_argument(
+        "--min-achieved",
+        type=float,
+        help="A trial also fails if the driver sends less than this percentage of the target RPS",
+        default=95,
+    )
+    parser.add_argument("--start-rps", type=int, help="First RPS level to try", default=50)
+    parser.add_argument("--max-rps", type=int, help="Highest RPS level to try", default=20000)
+    parser.add_argument("--step-factor", type=float, help="Multiply the RPS by this much while the SLO holds", default=2)
+    parser.add_argument("--precision", type=float, help="Stop bisecting once the bracket is this narrow (in percent)", default=5)
+    parser.add_argument("--trial-duration", type=int, help="Measured seconds per trial", default=15)
+    parser.add_argument("--trial-warmup", type=int, help="Unmeasured warmup seconds at the start of each trial", default=5)
+    parser.add_argument("--cooldown", type=int, help="Idle seconds between trials", default=5)
+    parser.add_argument("-t", "--timeout", type=int, help="Timeout (in miliseconds)", default=5000)
+    parser.add_argument("-w", "--workers", type=int, help="Number of load-generating processes", default=1)
+    parser.add_argument("--max-workers", type=int, help="Maximum number of requests in flight", default=20000)
+    parser.add_argument("--max-conns", type=int, help="Maximum connections per target host (0 for no limit)", default=0)
+    parser.add_argument("--http", type=str, help="HTTP version to use", default="1.1", choices=HTTP_VERSIONS)
+    parser.add_argument(
+        "-f",
+        "--file",
+        help=f"If set, write every measured curve to {VEGET_OUT_FOLDERNAME}/{CAPACITY_FILENAME}",
+        action="store_true",
+        default=False,
+    )
+    args = parser.parse_args()
+
+    all_feature_services = list(load_manifest())
+    services = args.service or [fs_name for fs_name in all_feature_services if fs_name in req_filenames]
+    missing = [fs_name for fs_name in services if fs_name not in req_filenames]
+    if len(services) == 0 or missing:
+        raise Exception(f"No request files for {missing or all_feature_services} in {REQS_DIR}. Run `gen_requests.py` first.")
+    if args.start_rps < 1 or args.step_factor <= 1:
+        raise Exception("--start-rps must be positive and --step-factor greater than 1")
+
+    api_key = ReqUtil._tecton_api_key()
+    pool_config = PoolConfig(max_conns_per_host=args.max_conns, http2=args.http == "2")
+
+    results = {}
+    for fs_name in services:
+        print(f"Searching capacity of {fs_name} (p99 <= {args.p99:g}ms, errors <= {args.max_error_rate:g}%)...")
+        corpus = load_corpus(REQS_DIR / fs_name, request_headers(api_key, pool_config))
+        search = CapacitySearch(corpus, pool_config, args)
+        results[fs_name] = {"max_rps": search.run(), "curve": [asdict(trial) for trial in search.curve]}
+
+    print(f"\n{'Feature Service':<40} {'Max RPS within SLO':>20}")
+    for fs_name, result in results.items():
+        max_rps = result["max_rps"]
+        print(f"{fs_name:<40} {max_rps if max_rps is not None else 'none':>20}")
+
+    if args.file:
+        VEGETA_OUT_DIR.mkdir(parents=True, exist_ok=True)
+        slo = {"p99_ms": args.p99, "max_error_rate": args.max_error_rate / 100}
+        (VEGETA_OUT_DIR / CAPACITY_FILENAME).write_text(json.dumps({"slo": slo, "services": results}, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,9 +1,12 @@
 #!/usr/bin/env python3
 import hashlib
+import json
 import os
 from pathlib import Path
 import stat
 
+from manifest import MANIFEST_FILE
+
 OUT_FILE = Path(__file__).parent / 'feature_services.py'
 RUN_SCRIPT = Path(__file__).parent / 'run_vegeta_all.sh'
 
@@ -155,6 +158,7 @@ def main():
 
     code = header
     last = "merchant"
+    feature_join_keys = {}
 
     for window, slide_period, counts in splits:
         for i, count in enumerate(counts):
@@ -167,6 +171,7 @@ def main():
                 subcounts = [count]
             for num_features in subcounts:
                 if window == "lifetime":
+                    join_key = 'cust_id'
                     feature_name = "load_test_lifetime_" + hashlib.sha1(repr(feature_view_num).encode()).hexdigest()
                     feature_code = gen_lifetime_feature(
                         num_features,
@@ -198,17 +203,20 @@ def main():
                         start_day
                     )
                 code += feature_code
+                feature_join_keys[feature_name] = join_key
                 fs[i].append(feature_name)
                 feature_view_num += 1
 
     fs_prefix = "fs"
     all_feature_services = []
+    fs_join_keys = {}
     for i in range(N_MIXED_FS):
         features = fs[i]
         if i > 0:
             fs[i] += fs[i-1]
         name = f"{fs_prefix}_mixed_{len(features)}_feature_views"
         all_feature_services.append(name)
+        fs_join_keys[name] = sorted({feature_join_keys[feature] for feature in features})
         code += gen_feature_service(name, features)
     for i in range(N_MIXED_FS, N_MIXED_FS*2):
         features = fs[i-N_MIXED_FS]
@@ -218,6 +226,7 @@ def main():
                 tfv_features.append(feature)
         name = f"{fs_prefix}_non_aggregate_{len(tfv_features)}_feature_views"
         all_feature_services.append(name)
+        fs_join_keys[name] = sorted({feature_join_keys[feature] for feature in tfv_features})
         code += gen_feature_service(name, tfv_features)
 
     fs_names = "\n".join([f'    "{fs_name}",' for fs_name in all_feature_services])
@@ -238,6 +247,15 @@ ALL_FEATURE_SERVICES = [
 
     OUT_FILE.write_text(code)
 
+    # Just the service names and their join keys, so the request and load tools can start
+    # without importing the Tecton SDK and thousands of feature views
+    manifest = {
+        "feature_services": [
+            {"name": fs_name, "join_keys": fs_join_keys[fs_name]} for fs_name in all_feature_services
+        ]
+    }
+    MANIFEST_FILE.write_text(json.dumps(manifest, indent=2) + "\n")
+
     script_lines = "\n".join([
         f"./run_vegeta.py --service {fs_name} --file -r 5 -d 10 -t 5000 &" for fs_name in all_feature_services
     ])
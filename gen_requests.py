@@ -1,15 +1,26 @@
 #!/usr/bin/env python3
 import argparse
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import asdict, dataclass, replace
+import hashlib
 from pathlib import Path
-from typing import Any, Dict, List
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
 from base64 import b64encode
+import itertools
 import json
+import math
 import os
+import random
 
-from feature_services import ALL_FEATURE_SERVICES
+from keyspace import DEFAULT_CARDINALITY, DISTRIBUTIONS, JOIN_KEYS, ORDERS, KeyDistribution, KeySpace, parse_cardinalities
+from manifest import load_manifest
+from target_file import SUFFIX, BodyTemplate, write_target_file
 
 
 REQS_DIR = Path(__file__).parent / "requests"
+WRITE_BUFFER_SIZE = 1 << 20  # bytes
+# Bump when the request file format changes, so that existing files are regenerated
+FORMAT_VERSION = 1
 
 
 def req_params(fs_name: str, ws_name: str, jk_map: Dict[str, str]) -> Dict[str, Any]:
@@ -22,8 +33,22 @@ def req_params(fs_name: str, ws_name: str, jk_map: Dict[str, str]) -> Dict[str,
     }
 
 
+def batch_req_params(fs_name: str, ws_name: str, jk_maps: List[Dict[str, str]]) -> Dict[str, Any]:
+    return {
+        "params": {
+            "feature_service_name": fs_name,
+            "request_data": [{"join_key_map": jk_map} for jk_map in jk_maps],
+            "workspace_name": ws_name,
+        }
+    }
+
+
 def web_req_with_b64_body(api_url: str, fs_name: str, ws_name: str, jk_map: Dict[str, str]) -> str:
-    params_json = json.dumps(req_params(fs_name, ws_name, jk_map))
+    return web_req_with_b64_params(api_url, req_params(fs_name, ws_name, jk_map))
+
+
+def web_req_with_b64_params(api_url: str, params: Dict[str, Any]) -> str:
+    params_json = json.dumps(params)
     return json.dumps(
         {
             "method": "POST",
@@ -33,6 +58,128 @@ def web_req_with_b64_body(api_url: str, fs_name: str, ws_name: str, jk_map: Dict
     )
 
 
+def api_url(cluster_url: str, batch: bool = False) -> str:
+    endpoint = "get-features-batch" if batch else "get-features"
+    return f"https://{cluster_url}/api/v1/feature-service/{endpoint}"
+
+
+def batched(key_tuples: Iterable[Tuple[int, ...]], batch_size: int) -> Iterator[List[Tuple[int, ...]]]:
+    key_tuples = iter(key_tuples)
+    while True:
+        batch = list(itertools.islice(key_tuples, batch_size))
+        if not batch:
+            return
+        yield batch
+
+
+def write_requests(fs_file: Path, requests: Iterable[str]) -> int:
+    # One request per line, streamed through a large buffer so memory stays flat however many
+    # requests there are. Written to a hidden temporary file first and moved into place, so
+    # a reader never sees a partial file.
+    count = 0
+    tmp_file = fs_file.with_name(f".{fs_file.name}.tmp")
+    with open(tmp_file, "w", encoding="utf-8", buffering=WRITE_BUFFER_SIZE) as f:
+        for request in requests:
+            f.write(request)
+            f.write("\n")
+            count += 1
+    os.replace(tmp_file, fs_file)
+    return count
+
+
+@dataclass
+class RequestFile:
+    # Everything that determines a request file's contents
+    cluster_url: str
+    fs_name: str
+    ws_name: str
+    cardinalities: Dict[str, int]  # of the service's join keys only
+    distribution: KeyDistribution
+    num_requests: Optional[int]
+    batch_size: Optional[int]
+    format: str = "json"  # or "binary", see target_file.py
+    compress: bool = False  # binary only
+
+    @property
+    def name(self) -> str:
+        name = self.fs_name if self.batch_size is None else f"{self.fs_name}_batch_{self.batch_size}"
+        return name + SUFFIX if self.format == "binary" else name
+
+    @property
+    def api_url(self) -> str:
+        return api_url(self.cluster_url, self.batch_size is not None)
+
+    @property
+    def count(self) -> int:
+        # --num-requests counts batch calls. By default, enough of them to cover the key space once
+        return self.num_requests or -(-math.prod(self.cardinalities.values()) // (self.batch_size or 1))
+
+    @property
+    def hash_file(self) -> Path:
+        return REQS_DIR / f".{self.name}.sha256"
+
+    def input_hash(self) -> str:
+        inputs = {"format_version": FORMAT_VERSION, **asdict(self)}
+        return hashlib.sha256(json.dumps(inputs, sort_keys=True).encode("utf-8")).hexdigest()
+
+    def up_to_date(self) -> bool:
+        return (REQS_DIR / self.name).exists() and self.hash_file.exists() and self.hash_file.read_text() == self.input_hash()
+
+    def params(self, jk_maps: List[Dict[str, str]]) -> Dict[str, Any]:
+        if self.batch_size is None:
+            return req_params(self.fs_name, self.ws_name, jk_maps[0])
+        return batch_req_params(self.fs_name, self.ws_name, jk_maps)
+
+    def key_batches(self) -> Iterator[List[Tuple[int, ...]]]:
+        # Each request's key tuples: one, or batch_size for get-features-batch
+        keys_per_request = self.batch_size or 1
+        key_tuples = self.distribution.key_tuples(KeySpace(self.cardinalities), self.count * keys_per_request)
+        return batched(key_tuples, keys_per_request)
+
+    def requests(self) -> Iterator[str]:
+        key_space = KeySpace(self.cardinalities)
+        for batch in self.key_batches():
+            yield web_req_with_b64_params(self.api_url, self.params([key_space.to_map(key_tuple) for key_tuple in batch]))
+
+    def template(self) -> BodyTemplate:
+        join_keys = list(self.cardinalities)
+        width = len(join_keys)
+        keys_per_request = self.batch_size or 1
+
+        def build(values: Iterable[str]) -> Dict[str, Any]:
+            values = list(values)
+            return self.params([dict(zip(join_keys, values[i * width:(i + 1) * width])) for i in range(keys_per_request)])
+
+        return BodyTemplate.from_params(build, width * keys_per_request)
+
+
+def generate(req_file: RequestFile) -> int:
+    # Runs in a worker process, one per request file
+    req_file.hash_file.unlink(missing_ok=True)
+    path = REQS_DIR / req_file.name
+    if req_file.format == "binary":
+        count = write_target_file(
+            path,
+            "POST",
+            req_file.api_url,
+            req_file.template(),
+            list(req_file.cardinalities),
+            req_file.batch_size or 1,
+            req_file.count,
+            (itertools.chain.from_iterable(batch) for batch in req_file.key_batches()),
+            req_file.compress,
+        )
+    else:
+        count = write_requests(path, req_file.requests())
+    req_file.hash_file.write_text(req_file.input_hash())
+    return count
+
+
+def request_file_names() -> List[str]:
+    # Hidden files in REQS_DIR are input hashes and in-progress writes, not request files
+    return sorted(req_file.name for req_file in REQS_DIR.iterdir() if not req_file.name.startswith("."))
+
+
 def clean_reqs_dir():
     try:
         REQS_DIR.mkdir(parents=True, exist_ok=True)
@@ -44,40 +191,130 @@ def clean_reqs_dir():
     REQS_DIR.mkdir(parents=True, exist_ok=True)
 
 
+def add_key_arguments(parser: argparse.ArgumentParser) -> None:
+    # How join keys are picked, shared with run_vegeta.py --synthesize
+    parser.add_argument(
+        "-k",
+        "--cardinality",
+        type=str,
+        help=f"Number of distinct values of a join key, as KEY=N (repeatable, default {DEFAULT_CARDINALITY} for each of {', '.join(JOIN_KEYS)})",
+        action="append",
+        default=[],
+    )
+    parser.add_argument(
+        "--distribution",
+        type=str,
+        help="How join keys are picked: a sweep through every combination in order, or drawn uniformly, Zipf-skewed or from a hot set",
+        default="sequential",
+        choices=DISTRIBUTIONS,
+    )
+    parser.add_argument(
+        "--order",
+        type=str,
+        help="With --distribution=sequential, the order key combinations are swept in: nested loops, a seeded shuffle, or interleaved so that consecutive requests hit distant keys",
+        default="sequential",
+        choices=ORDERS,
+    )
+    parser.add_argument("--zipf-exponent", type=float, help="Skew with --distribution=zipf: P(value k) ~ 1/k^s", default=1.0)
+    parser.add_argument("--hot-traffic", type=float, help="With --distribution=hotspot, percentage of lookups that go to the hot keys", default=80)
+    parser.add_argument("--hot-keys", type=float, help="With --distribution=hotspot, percentage of each join key's values that are hot", default=20)
+    parser.add_argument(
+        "-b",
+        "--batch-size",
+        type=int,
+        help="If set, send get-features-batch requests looking up this many keys each. Request files are named <feature_service>_batch_<size>",
+        default=None,
+    )
+
+
+def key_distribution(args: argparse.Namespace, seed: int) -> KeyDistribution:
+    if args.batch_size is not None and args.batch_size < 1:
+        raise Exception("--batch-size must be at least 1")
+    if args.zipf_exponent <= 0 or not 0 <= args.hot_traffic <= 100 or not 0 < args.hot_keys <= 100:
+        raise Exception("--zipf-exponent must be positive, --hot-traffic and --hot-keys percentages")
+    if args.order != "sequential" and args.distribution != "sequential":
+        raise Exception("--order applies to --distribution=sequential: randomly drawn keys are already in random order")
+    distribution = KeyDistribution(args.distribution, args.zipf_exponent, args.hot_traffic, args.hot_keys, seed, args.order)
+    if args.distribution == "sequential" and args.order == "sequential":
+        # The sweep doesn't depend on the seed, so it shouldn't invalidate existing files
+        return replace(distribution, seed=0)
+    print(f"Join keys: {distribution.describe()}")
+    return distribution
+
+
 def main():
     parser = argparse.ArgumentParser()
     parser.add_argument("cluster_url", type=str, help="Tecton cluster URL")
     parser.add_argument("ws_name", type=str, help="Workspace name")
+    add_key_arguments(parser)
+    parser.add_argument(
+        "-n",
+        "--num-requests",
+        type=int,
+        help="Requests per feature service (default: one per key combination)",
+        default=None,
+    )
+    parser.add_argument("--seed", type=int, help="Random seed for the uniform, zipf and hotspot distributions and --order (random if not set)", default=None)
+    parser.add_argument(
+        "--format",
+        type=str,
+        help="Write vegeta's JSON request files, or compact binary target files (<file>.tgt, asyncio engine only)",
+        default="json",
+        choices=["json", "binary"],
+    )
+    parser.add_argument(
+        "--compress",
+        help="zstd-compress binary target files (needs the `zstandard` package)",
+        action="store_true",
+        default=False,
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        help="Number of request files to generate in parallel (default: number of CPUs)",
+        default=None,
+    )
+    parser.add_argument(
+        "--clean",
+        help="Delete every existing request file first, instead of only regenerating the ones whose inputs changed",
+        action="store_true",
+        default=False,
+    )
     args = parser.parse_args()
-    api_url = f"https://{args.cluster_url}/api/v1/feature-service/get-features"
-
-
+    if args.num_requests is not None and args.num_requests < 1:
+        raise Exception("--num-requests must be at least 1")
+    if args.compress and args.format != "binary":
+        raise Exception("--compress requires --format=binary")
+    feature_services = load_manifest()
+    key_space = KeySpace(parse_cardinalities(args.cardinality))
+    distribution = key_distribution(args, args.seed if args.seed is not None else random.randrange(2**32))
 
-    values = list(range(1, 51))
-    mixed_jk_maps = [
-        {
-            "cust_id": str(val1),
-            "merchant_id": str(val2),
-        }
-       for val1 in values
-       for val2 in values
-    ]
-    nonaggregate_jk_maps = [
-        {
-            "cust_id": str(val),
-        }
-        for val in values
-    ]
-
-    clean_reqs_dir()
-    for fs_name in ALL_FEATURE_SERVICES:
-        if "mixed" in fs_name:
-            jk_maps = mixed_jk_maps
+    if args.clean:
+        clean_reqs_dir()
+    REQS_DIR.mkdir(parents=True, exist_ok=True)
+    req_files = []
+    for fs_name, join_keys in feature_services.items():
+        fs_key_space = key_space.subspace(join_keys)
+        req_file = RequestFile(
+            args.cluster_url,
+            fs_name,
+            args.ws_name,
+            dict(zip(fs_key_space.names, fs_key_space.cardinalities)),
+            distribution,
+            args.num_requests,
+            args.batch_size,
+            args.format,
+            args.compress,
+        )
+        if req_file.up_to_date():
+            print(f"{req_file.name}: up to date")
         else:
-            jk_maps = nonaggregate_jk_maps
-        b64_requests = [web_req_with_b64_body(api_url, fs_name, args.ws_name, jk_map) for jk_map in jk_maps]
-        fs_file = REQS_DIR / fs_name
-        fs_file.write_text("\n".join(b64_requests))
+            req_files.append(req_file)
+
+    with ProcessPoolExecutor(max_workers=args.jobs) as pool:
+        for req_file, count in zip(req_files, pool.map(generate, req_files)):
+            print(f"{req_file.name}: wrote {count} requests")
 
 
 if __name__ == '__main__':
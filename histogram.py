@@ -0,0 +1,137 @@
+import math
+from typing import Any, Dict, Iterable, List, Tuple
+
+# Log-linear bucketing in the spirit of HdrHistogram: values below SUB_BUCKET_COUNT are
+# recorded exactly, larger values keep SUB_BUCKET_BITS - 1 bits of mantissa, i.e. a
+# relative error of at most 1/1024.
+SUB_BUCKET_BITS = 11
+SUB_BUCKET_COUNT = 1 << SUB_BUCKET_BITS
+SUB_BUCKET_HALF = SUB_BUCKET_COUNT >> 1
+
+
+def bucket_index(value: int) -> int:
+    if value < SUB_BUCKET_COUNT:
+        return value
+    shift = value.bit_length() - SUB_BUCKET_BITS
+    return SUB_BUCKET_COUNT + (shift - 1) * SUB_BUCKET_HALF + (value >> shift) - SUB_BUCKET_HALF
+
+
+def bucket_bounds(index: int) -> Tuple[int, int]:
+    if index < SUB_BUCKET_COUNT:
+        return index, index
+    shift, offset = divmod(index - SUB_BUCKET_COUNT, SUB_BUCKET_HALF)
+    shift += 1
+    low = (offset + SUB_BUCKET_HALF) << shift
+    return low, low + (1 << shift) - 1
+
+
+def bucket_value(index: int) -> int:
+    low, high = bucket_bounds(index)
+    return (low + high) // 2
+
+
+class Histogram:
+    def __init__(self):
+        self.counts: Dict[int, int] = {}
+        self.total = 0
+        self.min = 0
+        self.max = 0
+        self.sum = 0
+
+    def record(self, value: int, count: int = 1) -> None:
+        value = max(int(value), 0)
+        index = bucket_index(value)
+        self.counts[index] = self.counts.get(index, 0) + count
+        if self.total == 0 or value < self.min:
+            self.min = value
+        if value > self.max:
+            self.max = value
+        self.total += count
+        self.sum += value * count
+
+    def merge(self, other: "Histogram") -> None:
+        if other.total == 0:
+            return
+        for index, count in other.counts.items():
+            self.counts[index] = self.counts.get(index, 0) + count
+        if self.total == 0 or other.min < self.min:
+            self.min = other.min
+        self.max = max(self.max, other.max)
+        self.total += other.total
+        self.sum += other.sum
+
+    def to_dict(self) -> Dict[str, Any]:
+        # Sparse, JSON-friendly and lossless: histograms rebuilt from it merge exactly
+        return {
+            "sub_bucket_bits": SUB_BUCKET_BITS,
+            "total": self.total,
+            "min": self.min,
+            "max": self.max,
+            "sum": self.sum,
+            "counts": [[index, count] for index, count in sorted(self.counts.items())],
+        }
+
+    @staticmethod
+    def from_dict(data: Dict[str, Any]) -> "Histogram":
+        if data["sub_bucket_bits"] != SUB_BUCKET_BITS:
+            raise Exception(f"Histogram has {data['sub_bucket_bits']} sub-bucket bits, expected {SUB_BUCKET_BITS}")
+        hist = Histogram()
+        hist.counts = {index: count for index, count in data["counts"]}
+        hist.total = data["total"]
+        hist.min = data["min"]
+        hist.max = data["max"]
+        hist.sum = data["sum"]
+        return hist
+
+    def mean(self) -> float:
+        return self.sum / self.total if self.total else 0.0
+
+    def percentiles(self, quantiles: Iterable[float]) -> List[int]:
+        quantiles = list(quantiles)
+        if self.total == 0:
+            return [0] * len(quantiles)
+        ranks = sorted((min(max(1, int(q / 100 * self.total + 0.5)), self.total), i) for i, q in enumerate(quantiles))
+        out = [self.max] * len(quantiles)
+        seen = 0
+        pending = 0
+        for index in sorted(self.counts):
+            seen += self.counts[index]
+            while pending < len(ranks) and seen >= ranks[pending][0]:
+                out[ranks[pending][1]] = min(max(bucket_value(index), self.min), self.max)
+                pending += 1
+            if pending == len(ranks):
+                break
+        return out
+
+    def percentile(self, quantile: float) -> int:
+        return self.percentiles([quantile])[0]
+
+    def stdev(self) -> float:
+        if self.total == 0:
+            return 0.0
+        mean = self.mean()
+        variance = sum(count * (bucket_value(index) - mean) ** 2 for index, count in self.counts.items()) / self.total
+        return variance ** 0.5
+
+
+def quantile_test(baseline: Histogram, candidate: Histogram, quantile: float) -> float:
+    # One-sided p-value for the candidate's percentile being higher than the baseline's, by
+    # Mood's median test generalized to any quantile: both samples are split at the percentile
+    # of the two combined, and a two-proportion z-test checks whether more of the candidate
+    # lies above it. Unlike a rank test of the whole distribution, it catches a shift in the
+    # tail alone (e.g. p99) and ignores one in the body. Values sharing the split's bucket
+    # count as below it.
+    n1, n2 = baseline.total, candidate.total
+    if n1 == 0 or n2 == 0:
+        return 1.0
+    pooled = Histogram()
+    pooled.merge(baseline)
+    pooled.merge(candidate)
+    split = bucket_index(pooled.percentile(quantile))
+    above1 = sum(count for index, count in baseline.counts.items() if index > split)
+    above2 = sum(count for index, count in candidate.counts.items() if index > split)
+    p = (above1 + above2) / (n1 + n2)
+    if p == 0 or p == 1:
+        return 1.0
+    z = (above2 / n2 - above1 / n1) / math.sqrt(p * (1 - p) * (1 / n1 + 1 / n2))
+    return 0.5 * math.erfc(z / math.sqrt(2))
@@ -0,0 +1,121 @@
+from collections import Counter
+import json
+import os
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from histogram import Histogram
+from results import Result
+
+# A run's latency histograms, one record per stage, with labels saying where they came from.
+# Histograms add up bucket by bucket, so records from any number of concurrent runs can be
+# merged into exact aggregate percentiles, unlike the percentiles in their text reports.
+SUFFIX = ".hist"
+FORMAT_VERSION = 1
+LABELS = ["run", "service", "phase", "stage", "host", "engine"]
+
+
+class HistogramRecord:
+    def __init__(self, labels: Dict[str, str]):
+        self.labels = labels
+        self.latencies = Histogram()
+        self.corrected = Histogram()
+        self.success = 0
+        self.status_codes: Counter = Counter()
+        # Wall-clock seconds of the first and last send, to compute rates of merged records
+        self.first: Optional[float] = None
+        self.last = 0.0
+
+    @staticmethod
+    def from_stats(stats, labels: Dict[str, str], wall_offset: float) -> "HistogramRecord":
+        # stats is a load_engine.AttackStats, whose times are on the monotonic clock:
+        # wall_offset converts them
+        record = HistogramRecord({**labels, "stage": stats.stage})
+        record.latencies.merge(stats.latencies)
+        record.corrected.merge(stats.corrected)
+        record.success = stats.success
+        record.status_codes.update(stats.status_codes)
+        if stats.first_sent is not None:
+            record.first = stats.first_sent + wall_offset
+            record.last = stats.last_sent + wall_offset
+        return record
+
+    def add(self, result: Result) -> None:
+        self.latencies.record(result.latency)
+        self.corrected.record(result.corrected)
+        if 200 <= result.status < 400:
+            self.success += 1
+        self.status_codes[result.status] += 1
+        if self.first is None or result.timestamp < self.first:
+            self.first = result.timestamp
+        self.last = max(self.last, result.timestamp)
+
+    def merge(self, other: "HistogramRecord") -> None:
+        self.latencies.merge(other.latencies)
+        self.corrected.merge(other.corrected)
+        self.success += other.success
+        self.status_codes.update(other.status_codes)
+        if other.first is not None:
+            if self.first is None or other.first < self.first:
+                self.first = other.first
+            self.last = max(self.last, other.last)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "labels": self.labels,
+            "latencies": self.latencies.to_dict(),
+            "corrected": self.corrected.to_dict(),
+            "success": self.success,
+            "status_codes": {str(code): count for code, count in sorted(self.status_codes.items())},
+            "first": self.first,
+            "last": self.last,
+        }
+
+    @staticmethod
+    def from_dict(data: Dict[str, Any]) -> "HistogramRecord":
+        record = HistogramRecord(data["labels"])
+        record.latencies = Histogram.from_dict(data["latencies"])
+        record.corrected = Histogram.from_dict(data["corrected"])
+        record.success = data["success"]
+        record.status_codes = Counter({int(code): count for code, count in data["status_codes"].items()})
+        record.first = data["first"]
+        record.last = data["last"]
+        return record
+
+
+def records_from_results(results: Iterable[Result], labels: Dict[str, str]) -> List[HistogramRecord]:
+    # One record per stage, from a stream of raw results
+    records: Dict[str, HistogramRecord] = {}
+    for result in results:
+        record = records.get(result.stage)
+        if record is None:
+            record = records[result.stage] = HistogramRecord({"stage": result.stage, **labels})
+        record.add(result)
+    return list(records.values())
+
+
+def write_histogram_file(path: Path, records: List[HistogramRecord]) -> None:
+    # Written to a hidden temporary file and moved into place, like the request files
+    data = {"format_version": FORMAT_VERSION, "records": [record.to_dict() for record in records]}
+    tmp_path = path.with_name(f".{path.name}.tmp")
+    tmp_path.write_text(json.dumps(data, separators=(",", ":")), encoding="utf-8")
+    os.replace(tmp_path, path)
+
+
+def read_histogram_file(path: Path) -> List[HistogramRecord]:
+    data = json.loads(path.read_text(encoding="utf-8"))
+    if data.get("format_version") != FORMAT_VERSION:
+        raise Exception(f"{path} has format version {data.get('format_version')}, expected {FORMAT_VERSION}")
+    return [HistogramRecord.from_dict(record) for record in data["records"]]
+
+
+def merge_records(records: Iterable[HistogramRecord], by: List[str]) -> Dict[Tuple[str, ...], HistogramRecord]:
+    # Groups records by the values of the labels in by (all records together if it's empty)
+    merged: Dict[Tuple[str, ...], HistogramRecord] = {}
+    for record in records:
+        key = tuple(record.labels.get(label, "") for label in by)
+        group = merged.get(key)
+        if group is None:
+            group = merged[key] = HistogramRecord(dict(zip(by, key)))
+        group.merge(record)
+    return merged
@@ -0,0 +1,294 @@
+import asyncio
+from collections import deque
+import ssl
+import time
+from typing import Deque, Dict, Iterable, List, Tuple
+
+try:
+    import h2.config
+    import h2.connection
+    import h2.errors
+    import h2.events
+    import h2.exceptions
+except ImportError:
+    h2 = None
+
+from corpus import USER_AGENT, Origin
+from load_engine import ConnectionStats, PoolConfig
+
+H2Request = Tuple[List[Tuple[bytes, bytes]], memoryview]
+
+READ_SIZE = 65536
+# Streams per connection assumed until the server's SETTINGS frame says otherwise. h2 starts
+# out with no limit, which would pile every concurrent request onto the first connection.
+DEFAULT_MAX_STREAMS = 100
+
+
+def require_h2() -> None:
+    if h2 is None:
+        raise Exception("HTTP/2 mode needs the `h2` package. Install it with `pip install h2`")
+
+
+def encode_h2_headers(origin: Origin) -> List[Tuple[bytes, bytes]]:
+    # Everything but the per-request content-length
+    h2_headers = [
+        (b":method", origin.method.encode("latin-1")),
+        (b":scheme", origin.scheme.encode("latin-1")),
+        (b":authority", origin.authority.encode("latin-1")),
+        (b":path", origin.path.encode("latin-1")),
+        (b"user-agent", USER_AGENT.encode("latin-1")),
+    ]
+    h2_headers += [(name.lower().encode("latin-1"), value.encode("latin-1")) for name, value in origin.headers.items()]
+    return h2_headers
+
+
+class _Stream:
+    def __init__(self, done: asyncio.Future):
+        self.done = done
+        self.status = 0
+        self.body_len = 0
+
+
+class H2Connection:
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self._reader = reader
+        self._writer = writer
+        self._conn = h2.connection.H2Connection(config=h2.config.H2Configuration(client_side=True, header_encoding=None))
+        self._conn.initiate_connection()
+        self._flush()
+        self._streams: Dict[int, _Stream] = {}
+        self._window_open = asyncio.Event()
+        self._read_task = asyncio.create_task(self._read_loop())
+        self.active = 0
+        self.idle_since = time.monotonic()
+        self.closed = False
+        self._settings_received = False
+
+    @property
+    def max_streams(self) -> int:
+        if not self._settings_received:
+            return DEFAULT_MAX_STREAMS
+        return self._conn.remote_settings.max_concurrent_streams
+
+    def _flush(self) -> None:
+        data = self._conn.data_to_send()
+        if data:
+            self._writer.write(data)
+
+    async def roundtrip(self, request: H2Request) -> Tuple[int, int, bool]:
+        if self.closed:
+            raise ConnectionError("HTTP/2 connection closed")
+        headers, body = request
+        try:
+            stream_id = self._conn.get_next_available_stream_id()
+        except h2.exceptions.ProtocolError as e:
+            raise ConnectionError(f"HTTP/2 stream failed: {e!r}") from e
+        stream = _Stream(asyncio.get_running_loop().create_future())
+        self._streams[stream_id] = stream
+        try:
+            self._conn.send_headers(stream_id, headers, end_stream=not body)
+            self._flush()
+            if body:
+                await self._send_body(stream_id, body)
+            await stream.done
+        except h2.exceptions.ProtocolError as e:
+            # E.g. the server reset the stream, or more streams than it allows are open:
+            # counted as a failed request like any other connection error
+            raise ConnectionError(f"HTTP/2 stream failed: {e!r}") from e
+        except asyncio.CancelledError:
+            if not self.closed and stream_id in self._streams:
+                try:
+                    self._conn.reset_stream(stream_id, h2.errors.ErrorCodes.CANCEL)
+                    self._flush()
+                except h2.exceptions.ProtocolError:
+                    # Already closed on the server's side
+                    pass
+            raise
+        finally:
+            self._streams.pop(stream_id, None)
+        return stream.status, stream.body_len, not self.closed
+
+    async def _send_body(self, stream_id: int, body: memoryview) -> None:
+        view = body
+        while view:
+            window = min(self._conn.local_flow_control_window(stream_id), self._conn.max_outbound_frame_size)
+            if window <= 0:
+                self._window_open.clear()
+                await self._window_open.wait()
+                continue
+            chunk, view = view[:window], view[window:]
+            self._conn.send_data(stream_id, bytes(chunk), end_stream=not view)
+            self._flush()
+
+    async def _read_loop(self) -> None:
+        error: Exception = ConnectionError("HTTP/2 connection closed by server")
+        try:
+            while True:
+                data = await self._reader.read(READ_SIZE)
+                if not data:
+                    break
+                for event in self._conn.receive_data(data):
+                    self._handle(event)
+                self._flush()
+        except (OSError, h2.exceptions.ProtocolError) as e:
+            error = ConnectionError(f"HTTP/2 connection failed: {e}")
+        finally:
+            self._fail_all(error)
+
+    def _handle(self, event: "h2.events.Event") -> None:
+        stream = self._streams.get(getattr(event, "stream_id", 0))
+        if isinstance(event, h2.events.ResponseReceived):
+            if stream is not None:
+                stream.status = int(dict(event.headers)[b":status"])
+        elif isinstance(event, h2.events.DataReceived):
+            self._conn.acknowledge_received_data(event.flow_controlled_length, event.stream_id)
+            if stream is not None:
+                stream.body_len += len(event.data)
+        elif isinstance(event, h2.events.StreamEnded):
+            if stream is not None and not stream.done.done():
+                stream.done.set_result(None)
+        elif isinstance(event, h2.events.StreamReset):
+            if stream is not None and not stream.done.done():
+                stream.done.set_exception(ConnectionError(f"HTTP/2 stream reset with {event.error_code!r}"))
+        elif isinstance(event, h2.events.WindowUpdated):
+            self._window_open.set()
+        elif isinstance(event, h2.events.RemoteSettingsChanged):
+            self._settings_received = True
+            # A larger initial window applies to every open stream
+            self._window_open.set()
+        elif isinstance(event, h2.events.ConnectionTerminated):
+            self._fail_all(ConnectionError(f"HTTP/2 connection terminated with {event.error_code!r}"))
+
+    def _fail_all(self, error: Exception) -> None:
+        self.closed = True
+        for stream in self._streams.values():
+            if not stream.done.done():
+                stream.done.set_exception(error)
+        self._window_open.set()
+
+    def close(self) -> None:
+        self.closed = True
+        self._read_task.cancel()
+        self._writer.close()
+
+
+class _H2HostPool:
+    def __init__(self):
+        self.conns: List[H2Connection] = []
+        self.opening = 0
+        self.waiters: Deque[asyncio.Future] = deque()
+
+
+class H2ConnectionPool:
+    # Same interface as load_engine.ConnectionPool, but hands out stream slots on a few
+    # multiplexed connections instead of exclusive connections
+    def __init__(self, config: PoolConfig, stats: ConnectionStats):
+        require_h2()
+        self._config = config
+        self.stats = stats
+        self._hosts: Dict[Tuple[str, str, int], _H2HostPool] = {}
+        self._ssl_context = ssl.create_default_context()
+        self._ssl_context.set_alpn_protocols(["h2"])
+
+    def _host(self, key: Tuple[str, str, int]) -> _H2HostPool:
+        host = self._hosts.get(key)
+        if host is None:
+            host = self._hosts[key] = _H2HostPool()
+        return host
+
+    def _wake_all(self, host: _H2HostPool) -> None:
+        while host.waiters:
+            waiter = host.waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+
+    def _discard(self, host: _H2HostPool, conn: H2Connection) -> None:
+        conn.close()
+        host.conns.remove(conn)
+        self.stats.closed += 1
+        self._wake_all(host)
+
+    async def _connect(self, scheme: str, host_name: str, port: int) -> H2Connection:
+        started = time.monotonic()
+        # Plain http uses h2c with prior knowledge, https negotiates h2 through ALPN
+        reader, writer = await asyncio.open_connection(
+            host_name,
+            port,
+            ssl=self._ssl_context if scheme == "https" else None,
+            server_hostname=host_name if scheme == "https" else None,
+        )
+        if scheme == "https" and writer.get_extra_info("ssl_object").selected_alpn_protocol() != "h2":
+            writer.close()
+            raise ConnectionError(f"{host_name}:{port} did not negotiate HTTP/2")
+        self.stats.opened += 1
+        self.stats.connect.record(int((time.monotonic() - started) * 1e6))
+        return H2Connection(reader, writer)
+
+    async def _open(self, scheme: str, host_name: str, port: int) -> H2Connection:
+        host = self._host((scheme, host_name, port))
+        host.opening += 1
+        try:
+            conn = await self._connect(scheme, host_name, port)
+        finally:
+            host.opening -= 1
+            self._wake_all(host)
+        host.conns.append(conn)
+        return conn
+
+    async def acquire(self, scheme: str, host_name: str, port: int) -> H2Connection:
+        host = self._host((scheme, host_name, port))
+        while True:
+            for conn in [conn for conn in host.conns if conn.closed]:
+                self._discard(host, conn)
+            available = [conn for conn in host.conns if conn.active < conn.max_streams]
+            if available:
+                conn = min(available, key=lambda conn: conn.active)
+                conn.active += 1
+                self.stats.reused += 1
+                return conn
+            # Only open another connection once every existing one is out of stream slots,
+            # and only one at a time, so streams pile onto as few connections as possible
+            max_conns = self._config.max_conns_per_host
+            if host.opening == 0 and (not max_conns or len(host.conns) < max_conns):
+                conn = await self._open(scheme, host_name, port)
+                conn.active += 1
+                return conn
+            waiter = asyncio.get_running_loop().create_future()
+            host.waiters.append(waiter)
+            await waiter
+
+    def release(self, scheme: str, host_name: str, port: int, conn: H2Connection, reusable: bool) -> None:
+        host = self._host((scheme, host_name, port))
+        conn.active -= 1
+        if conn.active == 0:
+            conn.idle_since = time.monotonic()
+        if conn.closed and conn in host.conns:
+            self._discard(host, conn)
+            return
+        self._wake_all(host)
+
+    async def prewarm(self, endpoints: Iterable[Tuple[str, str, int]]) -> None:
+        await asyncio.gather(
+            *(
+                self._open(scheme, host_name, port)
+                for scheme, host_name, port in set(endpoints)
+                for _ in range(self._config.prewarm)
+            )
+        )
+
+    async def reap_idle(self, interval: float = 1.0) -> None:
+        if self._config.idle_timeout is None:
+            return
+        while True:
+            await asyncio.sleep(interval)
+            now = time.monotonic()
+            for host in self._hosts.values():
+                for conn in list(host.conns):
+                    if conn.active == 0 and now - conn.idle_since >= self._config.idle_timeout:
+                        self._discard(host, conn)
+
+    def close(self) -> None:
+        for host in self._hosts.values():
+            for conn in host.conns:
+                conn.close()
+        self._hosts.clear()
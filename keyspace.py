@@ -0,0 +1,253 @@
+from dataclasses import dataclass
+import math
+import random
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+JOIN_KEYS = ["cust_id", "merchant_id"]
+DEFAULT_CARDINALITY = 50
+DISTRIBUTIONS = ["sequential", "uniform", "zipf", "hotspot"]
+ORDERS = ["sequential", "shuffle", "interleave"]
+FEISTEL_ROUNDS = 4
+
+
+class KeySpace:
+    # The cross product of each join key's values 1 through its cardinality, addressed by index
+    # instead of materialized: key_map(i) decodes i as a mixed-radix number, last key fastest
+    def __init__(self, cardinalities: Dict[str, int]):
+        self.names = list(cardinalities)
+        self.cardinalities = [cardinalities[name] for name in self.names]
+        self.size = math.prod(self.cardinalities)
+
+    def __len__(self) -> int:
+        return self.size
+
+    def key_tuple(self, index: int) -> Tuple[int, ...]:
+        values = []
+        for cardinality in reversed(self.cardinalities):
+            index, value = divmod(index, cardinality)
+            values.append(value + 1)
+        return tuple(reversed(values))
+
+    def key_map(self, index: int) -> Dict[str, str]:
+        return self.to_map(self.key_tuple(index))
+
+    def to_map(self, key_tuple: Tuple[int, ...]) -> Dict[str, str]:
+        return {name: str(value) for name, value in zip(self.names, key_tuple)}
+
+    def __iter__(self) -> Iterator[Dict[str, str]]:
+        return (self.key_map(index) for index in range(self.size))
+
+    def subspace(self, names: Iterable[str]) -> "KeySpace":
+        cardinalities = dict(zip(self.names, self.cardinalities))
+        return KeySpace({name: cardinalities[name] for name in names})
+
+
+def parse_cardinalities(specs: List[str]) -> Dict[str, int]:
+    # KEY=N overrides, e.g. ["cust_id=1000000"], on top of the defaults for every join key
+    cardinalities = {name: DEFAULT_CARDINALITY for name in JOIN_KEYS}
+    for spec in specs:
+        name, sep, value = spec.partition("=")
+        if not sep or name not in cardinalities or not value.isdigit() or int(value) < 1:
+            raise Exception(f"Invalid cardinality '{spec}', expected KEY=N with KEY one of {JOIN_KEYS} and N >= 1")
+        cardinalities[name] = int(value)
+    return cardinalities
+
+
+class _Zipf:
+    # Rejection-inversion sampling (Hörmann & Derflinger) of ranks 1..n with P(k) ~ 1 / k^s:
+    # constant time and memory per draw, however large n is
+    def __init__(self, n: int, s: float):
+        self._n = n
+        self._s = s
+        self._h_x1 = self._h_integral(1.5) - 1.0
+        self._h_n = self._h_integral(n + 0.5)
+        self._squeeze = 2.0 - self._h_integral_inverse(self._h_integral(2.5) - self._h(2.0))
+
+    def _h(self, x: float) -> float:
+        return math.exp(-self._s * math.log(x))
+
+    def _h_integral(self, x: float) -> float:
+        log_x = math.log(x)
+        t = (1.0 - self._s) * log_x
+        return (math.expm1(t) / t if abs(t) > 1e-8 else 1.0 + t / 2 * (1.0 + t / 3 * (1.0 + t / 4))) * log_x
+
+    def _h_integral_inverse(self, x: float) -> float:
+        t = max(x * (1.0 - self._s), -1.0)
+        return math.exp((math.log1p(t) / t if abs(t) > 1e-8 else 1.0 - t * (0.5 - t * (1.0 / 3 - t / 4))) * x)
+
+    def sample(self, rng: random.Random) -> int:
+        while True:
+            u = self._h_n + rng.random() * (self._h_x1 - self._h_n)
+            x = self._h_integral_inverse(u)
+            k = min(max(int(x + 0.5), 1), self._n)
+            if k - x <= self._squeeze or u >= self._h_integral(k + 0.5) - self._h(k):
+                return k
+
+
+def _identity(index: int) -> int:
+    return index
+
+
+class _Feistel:
+    # A seeded pseudorandom permutation of [0, n) that maps any index in constant time and
+    # memory: a balanced Feistel network over the smallest even number of bits covering n,
+    # cycle-walking past values >= n (fewer than 4 rounds of walking on average)
+    def __init__(self, n: int, seed: int):
+        self._n = n
+        self._half = max((n - 1).bit_length() + 1, 2) // 2
+        self._mask = (1 << self._half) - 1
+        rng = random.Random(seed)
+        self._keys = [rng.getrandbits(64) for _ in range(FEISTEL_ROUNDS)]
+
+    def _round(self, value: int, key: int) -> int:
+        # Fibonacci hashing: the top bits of a 64-bit multiplicative hash
+        return ((value ^ key) * 0x9E3779B97F4A7C15 & 0xFFFFFFFFFFFFFFFF) >> (64 - self._half)
+
+    def __call__(self, index: int) -> int:
+        while True:
+            left, right = index >> self._half, index & self._mask
+            for key in self._keys:
+                left, right = right, left ^ self._round(right, key)
+            index = left << self._half | right
+            if index < self._n:
+                return index
+
+
+class _SplitMix64:
+    # The random.Random methods the samplers use, over SplitMix64 (Steele et al., 2014): cheap to
+    # reseed, so that every index gets its own stream without building a Random per draw
+    __slots__ = ("state",)
+
+    def __init__(self, state: int = 0):
+        self.state = state
+
+    def next(self) -> int:
+        self.state = (self.state + 0x9E3779B97F4A7C15) & 0xFFFFFFFFFFFFFFFF
+        z = self.state
+        z = ((z ^ (z >> 30)) * 0xBF58476D1CE4E5B9) & 0xFFFFFFFFFFFFFFFF
+        z = ((z ^ (z >> 27)) * 0x94D049BB133111EB) & 0xFFFFFFFFFFFFFFFF
+        return z ^ (z >> 31)
+
+    def random(self) -> float:
+        return (self.next() >> 11) * (1.0 / (1 << 53))
+
+    def randrange(self, start: int, stop: Optional[int] = None) -> int:
+        if stop is None:
+            start, stop = 0, start
+        # Multiply-shift: the bias is below (stop - start) / 2^64
+        return start + (self.next() * (stop - start) >> 64)
+
+
+class _Stride:
+    # Visits [0, n) with a fixed step coprime to n, near n / golden ratio, from a seeded
+    # start: consecutive indices land far apart, and every index is visited once per n steps
+    def __init__(self, n: int, seed: int):
+        rng = random.Random(seed)
+        self._n = n
+        self._start = rng.randrange(n)
+        self._step = max(round(n * 0.6180339887498949), 1)
+        while math.gcd(self._step, n) != 1:
+            self._step += 1
+
+    def __call__(self, index: int) -> int:
+        return (self._start + index * self._step) % self._n
+
+
+@dataclass
+class Ordering:
+    # The order a sequence of n items is walked in: as is, pseudorandomly shuffled, or
+    # interleaved so that neighbours end up far apart. The same seed gives the same order.
+    kind: str = "sequential"
+    seed: int = 0
+
+    def permutation(self, n: int) -> Callable[[int], int]:
+        # Maps position i in [0, n) to the item sent at that position
+        if self.kind == "sequential" or n <= 1:
+            return _identity
+        if self.kind == "shuffle":
+            return _Feistel(n, self.seed)
+        if self.kind == "interleave":
+            return _Stride(n, self.seed)
+        raise Exception(f"Unknown order '{self.kind}', expected one of {ORDERS}")
+
+    def describe(self) -> str:
+        return self.kind if self.kind == "sequential" else f"{self.kind}, seed {self.seed}"
+
+
+@dataclass
+class KeyDistribution:
+    kind: str = "sequential"
+    zipf_exponent: float = 1.0  # zipf only: the s in P(value k) ~ 1 / k^s
+    hot_traffic: float = 80.0  # hotspot only: percentage of lookups that go to the hot keys
+    hot_keys: float = 20.0  # hotspot only: percentage of each key's values that are hot
+    seed: int = 0
+    order: str = "sequential"  # sequential only: how the sweep walks the key space, see Ordering
+
+    def key_maps(self, key_space: KeySpace, count: int) -> Iterator[Dict[str, str]]:
+        return (key_space.to_map(key_tuple) for key_tuple in self.key_tuples(key_space, count))
+
+    def key_tuples(self, key_space: KeySpace, count: int) -> Iterator[Tuple[int, ...]]:
+        # count key tuples drawn from key_space. Apart from the sequential sweep, each join key is
+        # drawn independently, so e.g. a few customers and a few merchants are hot, with low
+        # values the most popular ones
+        if self.kind == "sequential":
+            permutation = Ordering(self.order, self.seed).permutation(key_space.size)
+            yield from (key_space.key_tuple(permutation(index % key_space.size)) for index in range(count))
+            return
+        rng = random.Random(self.seed)
+        samplers = self._samplers(key_space)
+        for _ in range(count):
+            yield tuple(sample(rng) + 1 for sample in samplers)
+
+    def _samplers(self, key_space: KeySpace) -> List[Callable[[random.Random], int]]:
+        return [self._sampler(cardinality) for cardinality in key_space.cardinalities]
+
+    def _sampler(self, cardinality: int) -> Callable[[random.Random], int]:
+        # Returns a function drawing a value index in [0, cardinality)
+        if self.kind == "uniform":
+            return lambda rng: rng.randrange(cardinality)
+        if self.kind == "zipf":
+            zipf = _Zipf(cardinality, self.zipf_exponent)
+            return lambda rng: zipf.sample(rng) - 1
+        if self.kind == "hotspot":
+            hot = min(max(math.ceil(cardinality * self.hot_keys / 100), 1), cardinality)
+            if hot == cardinality:
+                return lambda rng: rng.randrange(cardinality)
+            return lambda rng: rng.randrange(hot) if rng.random() * 100 < self.hot_traffic else rng.randrange(hot, cardinality)
+        raise Exception(f"Unknown key distribution '{self.kind}', expected one of {DISTRIBUTIONS}")
+
+    def describe(self) -> str:
+        if self.kind == "sequential":
+            return f"sequential, {Ordering(self.order, self.seed).describe()} order"
+        if self.kind == "zipf":
+            return f"zipf s={self.zipf_exponent:g}, seed {self.seed}"
+        if self.kind == "hotspot":
+            return f"hotspot {self.hot_traffic:g}% of lookups to {self.hot_keys:g}% of keys, seed {self.seed}"
+        return f"{self.kind}, seed {self.seed}"
+
+
+class KeySampler:
+    # Counter-based draws from a KeyDistribution: the index-th key tuple depends only on the seed
+    # and the index, so shards and out-of-order senders all draw from one reproducible sequence
+    def __init__(self, distribution: KeyDistribution, key_space: KeySpace):
+        self.distribution = distribution
+        self.key_space = key_space
+        self._samplers: Optional[List[Callable[[random.Random], int]]] = None
+        self._permutation = Ordering(distribution.order, distribution.seed).permutation(key_space.size)
+        # Index i's draws are SplitMix64's from state seed_state ^ i, with the seed mixed first
+        # so that nearby seeds don't give overlapping streams
+        self._seed_state = _SplitMix64(distribution.seed & 0xFFFFFFFFFFFFFFFF).next()
+        self._rng = _SplitMix64()
+
+    def __call__(self, index: int) -> Tuple[int, ...]:
+        if self.distribution.kind == "sequential":
+            return self.key_space.key_tuple(self._permutation(index % self.key_space.size))
+        if self._samplers is None:
+            self._samplers = self.distribution._samplers(self.key_space)
+        rng = self._rng
+        rng.state = self._seed_state ^ index
+        return tuple(sample(rng) + 1 for sample in self._samplers)
+
+    def __getstate__(self) -> dict:
+        # The samplers are closures, rebuilt on first use in the receiving process
+        return {**self.__dict__, "_samplers": None}
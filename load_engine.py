@@ -0,0 +1,863 @@
+import asyncio
+from contextlib import asynccontextmanager
+from collections import Counter, deque
+import copy
+from dataclasses import dataclass, field, replace
+import itertools
+import math
+import multiprocessing
+import queue as queue_module
+import resource
+import ssl
+import time
+from typing import Callable, Deque, Dict, Iterable, List, Optional, Set, TextIO, Tuple, Union
+
+from arrivals import ArrivalProcess
+from corpus import Corpus, TemplateCorpus
+from histogram import Histogram
+from keyspace import Ordering
+from load_profile import Profile
+from replay import Replay, TraceCorpus
+from results import ColumnWriter, ResultLog, ResultWriter
+from warmup import INTERVAL, MIN_INTERVALS, Timeline
+
+REPORT_QUANTILES = [50, 90, 95, 99]
+# Called with every stage's stats and the index of the stage currently being sent
+ReportCallback = Callable[[List["AttackStats"], int], None]
+SHARD_STARTUP_DELAY = 1.0  # seconds
+LATE_THRESHOLD_US = 1000  # sends this far behind schedule count as late
+
+
+def merge_stats(shard_stats: Iterable["AttackStats"], stage: str = "") -> "AttackStats":
+    merged = AttackStats(stage)
+    for stats in shard_stats:
+        merged.merge(stats)
+    return merged
+
+
+def fmt_duration(seconds: float) -> str:
+    # Mimics Go's time.Duration formatting so reports read like vegeta's
+    if seconds >= 1:
+        return f"{seconds:.3f}s"
+    if seconds >= 1e-3:
+        return f"{seconds * 1e3:.3f}ms"
+    return f"{seconds * 1e6:.3f}µs"
+
+
+def fmt_latencies(hist: Histogram) -> str:
+    values = [hist.min, hist.mean()] + hist.percentiles(REPORT_QUANTILES) + [hist.max]
+    return ", ".join(fmt_duration(v / 1e6) for v in values)
+
+
+def fmt_arrivals(hist: Histogram) -> str:
+    # The coefficient of variation is 0 for a constant rate and 1 for Poisson arrivals
+    cv = hist.stdev() / hist.mean() if hist.mean() else 0.0
+    p50, p99 = hist.percentiles([50, 99])
+    return f"{fmt_duration(hist.mean() / 1e6)}, {cv:.2f}, " + ", ".join(fmt_duration(v / 1e6) for v in [p50, p99, hist.max])
+
+
+class AttackStats:
+    def __init__(self, stage: str = ""):
+        self.stage = stage
+        # Microseconds. `latencies` is measured from the actual send time (what vegeta reports),
+        # `corrected` from the time the rate schedule intended the request to go out, so it
+        # includes any queueing delay in the driver itself (coordinated omission).
+        self.latencies = Histogram()
+        self.corrected = Histogram()
+        self.lag = Histogram()
+        self.late = 0
+        # Microseconds between consecutive scheduled sends, i.e. the arrival process as realized
+        self.arrivals = Histogram()
+        self.connections = ConnectionStats()
+        self.users = 0
+        # Join keys each request looks up, above 1 for get-features-batch requests
+        self.keys_per_request = 1
+        # CPU seconds the driver process spent, to compare the cost of transports and engines
+        self.cpu_user = 0.0
+        self.cpu_system = 0.0
+        self.start_cpu()
+        self.status_codes: Counter = Counter()
+        self.errors: Set[str] = set()
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.success = 0
+        self.first_sent: Optional[float] = None
+        self.last_sent = 0.0
+        self.last_done = 0.0
+        # Per-interval results, kept when the warmup is to be detected (see warmup.py)
+        self.timeline: Optional[Timeline] = None
+        # Set by trim_warmup: whether latency settled, and if so how long it took, how many
+        # requests were sent before and the send time the steady state starts at
+        self.settled: Optional[bool] = None
+        self.warmup = 0.0
+        self.warmup_requests = 0
+        self.warmup_end: Optional[float] = None
+
+    def add(self, intended: float, sent: float, done: float, status: int, bytes_in: int, bytes_out: int, error: str) -> None:
+        latency = int((done - sent) * 1e6)
+        corrected = int((done - min(intended, sent)) * 1e6)
+        self.latencies.record(latency)
+        self.corrected.record(corrected)
+        lag = int((sent - intended) * 1e6)
+        self.lag.record(lag)
+        if lag >= LATE_THRESHOLD_US:
+            self.late += 1
+        self.status_codes[status] += 1
+        if error:
+            self.errors.add(error)
+        if 200 <= status < 400:
+            self.success += 1
+        self.bytes_in += bytes_in
+        self.bytes_out += bytes_out
+        if self.first_sent is None or sent < self.first_sent:
+            self.first_sent = sent
+        self.last_sent = max(self.last_sent, sent)
+        self.last_done = max(self.last_done, done)
+        if self.timeline is not None:
+            self.timeline.add(sent, latency, corrected, status, bytes_in, bytes_out)
+
+    def trim_warmup(self) -> None:
+        # Drops the requests sent before latency settled from the results. Send lag, arrivals,
+        # connections and errors still cover the whole run.
+        split = self.timeline.split()
+        self.settled = split is not None
+        if split is None:
+            return
+        warmup, steady = split
+        self.warmup_requests = warmup.latencies.total
+        if self.warmup_requests:
+            self.warmup = steady.first_sent - self.first_sent
+            # The start of the first steady interval: every request sent before is warmup
+            self.warmup_end = math.floor(steady.first_sent / INTERVAL) * INTERVAL
+            self.latencies = steady.latencies
+            self.corrected = steady.corrected
+            self.status_codes = steady.status_codes
+            self.success = steady.success
+            self.bytes_in = steady.bytes_in
+            self.bytes_out = steady.bytes_out
+            self.first_sent = steady.first_sent
+
+    def start_cpu(self) -> None:
+        self._usage_start = resource.getrusage(resource.RUSAGE_SELF)
+
+    def update_cpu(self) -> None:
+        usage = resource.getrusage(resource.RUSAGE_SELF)
+        self.cpu_user = usage.ru_utime - self._usage_start.ru_utime
+        self.cpu_system = usage.ru_stime - self._usage_start.ru_stime
+
+    def merge(self, other: "AttackStats") -> None:
+        self.cpu_user += other.cpu_user
+        self.cpu_system += other.cpu_system
+        if other.first_sent is None:
+            return
+        self.latencies.merge(other.latencies)
+        self.corrected.merge(other.corrected)
+        self.lag.merge(other.lag)
+        self.arrivals.merge(other.arrivals)
+        self.late += other.late
+        self.users += other.users
+        self.keys_per_request = max(self.keys_per_request, other.keys_per_request)
+        self.connections.merge(other.connections)
+        self.status_codes.update(other.status_codes)
+        self.errors |= other.errors
+        self.success += other.success
+        self.bytes_in += other.bytes_in
+        self.bytes_out += other.bytes_out
+        if self.first_sent is None or other.first_sent < self.first_sent:
+            self.first_sent = other.first_sent
+        self.last_sent = max(self.last_sent, other.last_sent)
+        self.last_done = max(self.last_done, other.last_done)
+        if other.timeline is not None:
+            if self.timeline is None:
+                self.timeline = Timeline()
+            self.timeline.merge(other.timeline)
+
+    def report(self) -> str:
+        total = self.latencies.total
+        attack = self.last_sent - self.first_sent if total else 0.0
+        wait = self.last_done - self.last_sent if total else 0.0
+        rate = total / attack if attack > 0 else 0.0
+        throughput = self.success / (attack + wait) if attack + wait > 0 else 0.0
+        quantile_names = ", ".join(str(q) for q in REPORT_QUANTILES)
+        lag = [self.lag.mean()] + self.lag.percentiles([99]) + [self.lag.max]
+        conns = self.connections
+        connect = [conns.connect.mean()] + conns.connect.percentiles([50, 99]) + [conns.connect.max]
+        keys = self.keys_per_request
+        # A batch's latency spread over its keys, to compare against one single-key call per key
+        per_key = [self.latencies.mean()] + self.latencies.percentiles([50, 99])
+        codes = "  ".join(f"{code}:{count}" for code, count in sorted(self.status_codes.items()))
+        if self.settled:
+            warmup = fmt_duration(self.warmup)
+        elif self.timeline is not None and len(self.timeline.intervals) < MIN_INTERVALS:
+            warmup = "run too short to tell"
+        else:
+            warmup = "latency didn't settle"
+        lines = [
+            f"Requests      [total, rate, throughput]  {total}, {rate:.2f}, {throughput:.2f}",
+            f"Duration      [total, attack, wait]  {fmt_duration(attack + wait)}, {fmt_duration(attack)}, {fmt_duration(wait)}",
+            *([f"Warmup        [detected, excluded]  {warmup}, {self.warmup_requests}"] if self.settled is not None else []),
+            f"Latencies     [min, mean, {quantile_names}, max]  {fmt_latencies(self.latencies)}",
+            f"Corrected     [min, mean, {quantile_names}, max]  {fmt_latencies(self.corrected)}",
+            f"Send Lag      [late, mean, 99, max]  {self.late}, " + ", ".join(fmt_duration(v / 1e6) for v in lag),
+            f"Connections   [opened, reused, closed]  {conns.opened}, {conns.reused}, {conns.closed}",
+            f"Connect       [mean, 50, 99, max]  " + ", ".join(fmt_duration(v / 1e6) for v in connect),
+            *([f"Concurrency   [users]  {self.users}"] if self.users else []),
+            *(
+                [f"Per Key       [keys/request, keys/s, mean, 50, 99]  {keys}, {rate * keys:.2f}, "
+                 + ", ".join(fmt_duration(v / keys / 1e6) for v in per_key)]
+                if keys > 1 else []
+            ),
+            *([f"Arrivals      [mean gap, cv, 50, 99, max]  {fmt_arrivals(self.arrivals)}"] if self.arrivals.total else []),
+            f"Driver CPU    [user, system]  {fmt_duration(self.cpu_user)}, {fmt_duration(self.cpu_system)}",
+            f"Bytes In      [total, mean]  {self.bytes_in}, {self.bytes_in / total if total else 0:.2f}",
+            f"Bytes Out     [total, mean]  {self.bytes_out}, {self.bytes_out / total if total else 0:.2f}",
+            f"Success       [ratio]  {100 * self.success / total if total else 0:.2f}%",
+            f"Status Codes  [code:count]  {codes}",
+            "Error Set:",
+        ]
+        lines += sorted(self.errors)
+        return "\n".join(lines) + "\n"
+
+
+class Connection:
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.reader = reader
+        self.writer = writer
+        # Scratch space for synthesized requests. Reused for the next request once the response
+        # has arrived, since the transport may hold on to the bytes until they're sent.
+        self.buffer = bytearray()
+
+    async def roundtrip(self, message: bytes) -> Tuple[int, int, bool]:
+        self.writer.write(message)
+        head = await self.reader.readuntil(b"\r\n\r\n")
+        status_line, *header_lines = head[:-4].decode("latin-1").split("\r\n")
+        parts = status_line.split(" ", 2)
+        if len(parts) < 2 or not parts[0].startswith("HTTP/") or len(parts[1]) != 3 or not parts[1].isdigit():
+            raise ValueError(f"malformed status line {status_line!r}")
+        status = int(parts[1])
+        headers = {}
+        for line in header_lines:
+            name, _, value = line.partition(":")
+            headers[name.strip().lower()] = value.strip()
+        keep_alive = headers.get("connection", "").lower() != "close"
+        if headers.get("transfer-encoding", "").lower() == "chunked":
+            body_len = 0
+            while True:
+                size = int((await self.reader.readuntil(b"\r\n")).split(b";")[0], 16)
+                if size == 0:
+                    await self._read_trailers()
+                    break
+                await self.reader.readexactly(size + 2)
+                body_len += size
+        elif "content-length" in headers:
+            body_len = int(headers["content-length"])
+            await self.reader.readexactly(body_len)
+        else:
+            body_len = len(await self.reader.read())
+            keep_alive = False
+        return status, body_len, keep_alive
+
+    async def _read_trailers(self) -> None:
+        while await self.reader.readuntil(b"\r\n") != b"\r\n":
+            pass
+
+    def close(self) -> None:
+        self.writer.close()
+
+
+@dataclass
+class Load:
+    duration: int  # seconds
+    rate: float = 0  # open loop: requests per second, sent on schedule whatever the latency
+    users: int = 0  # closed loop: virtual users, each waiting for its response before sending again
+    think_time: float = 0.0  # closed loop: seconds a user pauses between response and next request
+    profile: Optional[Profile] = None  # open loop: rate shape over time, replacing rate and duration
+    arrivals: ArrivalProcess = field(default_factory=ArrivalProcess)  # open loop: spacing between requests
+    replay: Optional[Replay] = None  # open loop: send a trace's requests at their recorded times instead
+    order: Ordering = field(default_factory=Ordering)  # order the corpus is walked in
+    detect_warmup: bool = False  # drop the requests sent before latency settled, see warmup.py
+
+    def schedule(self) -> Profile:
+        if self.profile is not None:
+            return self.profile
+        if self.rate <= 0:
+            raise Exception(f"Rate must be positive, got {self.rate}")
+        return Profile.constant(self.rate, self.duration)
+
+
+@dataclass
+class PoolConfig:
+    max_conns_per_host: int = 0  # 0 means unlimited
+    idle_timeout: Optional[float] = 90.0  # seconds, None means idle connections are kept forever
+    keepalive: bool = True
+    prewarm: int = 0  # connections to open per host before the attack starts
+    http2: bool = False
+
+
+def request_headers(api_key: str, pool_config: PoolConfig) -> Dict[str, str]:
+    # Headers added to every request, baked into the corpus when it's encoded
+    headers = {"Authorization": f"Tecton-key {api_key}"}
+    if not pool_config.keepalive:
+        headers["Connection"] = "close"
+    return headers
+
+
+class ConnectionStats:
+    def __init__(self):
+        self.opened = 0
+        self.reused = 0
+        self.closed = 0
+        self.connect = Histogram()  # microseconds spent in TCP connect + TLS handshake
+
+    def merge(self, other: "ConnectionStats") -> None:
+        self.opened += other.opened
+        self.reused += other.reused
+        self.closed += other.closed
+        self.connect.merge(other.connect)
+
+
+class _HostPool:
+    def __init__(self):
+        self.idle: List[Tuple[Connection, float]] = []
+        self.open = 0
+        self.waiters: Deque[asyncio.Future] = deque()
+
+
+class ConnectionPool:
+    def __init__(self, config: PoolConfig, stats: ConnectionStats):
+        self._config = config
+        self.stats = stats
+        self._hosts: Dict[Tuple[str, str, int], _HostPool] = {}
+        self._ssl_context = ssl.create_default_context()
+
+    def _host(self, key: Tuple[str, str, int]) -> _HostPool:
+        host = self._hosts.get(key)
+        if host is None:
+            host = self._hosts[key] = _HostPool()
+        return host
+
+    def _wake(self, host: _HostPool) -> None:
+        while host.waiters:
+            waiter = host.waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+
+    def _pop_idle(self, host: _HostPool) -> Optional[Connection]:
+        now = time.monotonic()
+        while host.idle:
+            conn, idle_since = host.idle.pop()
+            expired = self._config.idle_timeout is not None and now - idle_since >= self._config.idle_timeout
+            if not expired and not conn.reader.at_eof() and not conn.writer.is_closing():
+                self.stats.reused += 1
+                return conn
+            self._discard(host, conn)
+        return None
+
+    def _discard(self, host: _HostPool, conn: Connection) -> None:
+        conn.close()
+        host.open -= 1
+        self.stats.closed += 1
+        self._wake(host)
+
+    async def _connect(self, scheme: str, host: str, port: int) -> Connection:
+        started = time.monotonic()
+        reader, writer = await asyncio.open_connection(
+            host,
+            port,
+            ssl=self._ssl_context if scheme == "https" else None,
+            server_hostname=host if scheme == "https" else None,
+        )
+        self.stats.opened += 1
+        self.stats.connect.record(int((time.monotonic() - started) * 1e6))
+        return Connection(reader, writer)
+
+    async def acquire(self, scheme: str, host_name: str, port: int) -> Connection:
+        host = self._host((scheme, host_name, port))
+        while True:
+            conn = self._pop_idle(host)
+            if conn is not None:
+                return conn
+            if not self._config.max_conns_per_host or host.open < self._config.max_conns_per_host:
+                break
+            # At the per-host limit: wait for a connection to be released or closed
+            waiter = asyncio.get_running_loop().create_future()
+            host.waiters.append(waiter)
+            try:
+                await waiter
+            except asyncio.CancelledError:
+                if waiter.done() and not waiter.cancelled():
+                    self._wake(host)
+                raise
+        host.open += 1
+        try:
+            return await self._connect(scheme, host_name, port)
+        except BaseException:
+            host.open -= 1
+            self._wake(host)
+            raise
+
+    def release(self, scheme: str, host_name: str, port: int, conn: Connection, reusable: bool) -> None:
+        host = self._host((scheme, host_name, port))
+        if not reusable or not self._config.keepalive:
+            self._discard(host, conn)
+            return
+        host.idle.append((conn, time.monotonic()))
+        self._wake(host)
+
+    async def prewarm(self, endpoints: Iterable[Tuple[str, str, int]]) -> None:
+        # Every connection is held until all are open, so more than the per-host limit would
+        # wait forever. A shard's rounded-up share of the limits can get here.
+        count = self._config.prewarm
+        if self._config.max_conns_per_host:
+            count = min(count, self._config.max_conns_per_host)
+        conns = []
+        for scheme, host_name, port in set(endpoints):
+            for _ in range(count):
+                conns.append(((scheme, host_name, port), self.acquire(scheme, host_name, port)))
+        opened = await asyncio.gather(*(acquire for _, acquire in conns))
+        for (key, _), conn in zip(conns, opened):
+            self.release(*key, conn, True)
+
+    async def reap_idle(self, interval: float = 1.0) -> None:
+        if self._config.idle_timeout is None:
+            return
+        while True:
+            await asyncio.sleep(interval)
+            now = time.monotonic()
+            for host in self._hosts.values():
+                expired = [conn for conn, idle_since in host.idle if now - idle_since >= self._config.idle_timeout]
+                if expired:
+                    host.idle = [(conn, idle_since) for conn, idle_since in host.idle if now - idle_since < self._config.idle_timeout]
+                    for conn in expired:
+                        self._discard(host, conn)
+
+    def close(self) -> None:
+        # Connections still open at the end of the run aren't counted as closed
+        for host in self._hosts.values():
+            for conn, _ in host.idle:
+                conn.close()
+        self._hosts.clear()
+
+
+class Attacker:
+    def __init__(
+        self,
+        corpus: Union[Corpus, TemplateCorpus, TraceCorpus],
+        timeout: float,
+        max_workers: int,
+        pool_config: PoolConfig,
+        partitioned: bool = False,
+    ):
+        self._corpus = corpus
+        self._partitioned = partitioned
+        self._pool_config = pool_config
+        # Per origin, not per request: the corpus already holds every encoded message
+        self._endpoints = [(origin.scheme, origin.host, origin.port) for origin in corpus.origins]
+        self._h2_headers = None
+        if pool_config.http2:
+            from http2 import encode_h2_headers, require_h2
+
+            require_h2()
+            self._h2_headers = [encode_h2_headers(origin) for origin in corpus.origins]
+        self._timeout = timeout
+        self._max_workers = max_workers
+        self._results: Optional[Union[ResultWriter, ColumnWriter]] = None
+        self._stage_ids: Dict[int, int] = {}
+        # Open loop and replay: when the previous request actually went out, to record the
+        # arrival process as achieved
+        self._track_arrivals = False
+        self._last_sent: Optional[float] = None
+
+    def _pool(self, stats: AttackStats) -> "ConnectionPool":
+        if self._pool_config.http2:
+            from http2 import H2ConnectionPool
+
+            return H2ConnectionPool(self._pool_config, stats.connections)
+        return ConnectionPool(self._pool_config, stats.connections)
+
+    def _message(self, index: int, conn: Connection):
+        # The message to send on conn and its body length
+        if self._h2_headers is None:
+            return self._corpus.request(index, conn.buffer)
+        body = self._corpus.body(index)
+        headers = self._h2_headers[self._corpus.origin_id(index)] + [(b"content-length", b"%d" % len(body))]
+        return (headers, memoryview(body)), len(body)
+
+    async def _send(self, pool: ConnectionPool, index: int) -> Tuple[int, int, int]:
+        scheme, host, port = self._endpoints[self._corpus.origin_id(index)]
+        conn = await pool.acquire(scheme, host, port)
+        try:
+            message, bytes_out = self._message(index, conn)
+            status, body_len, keep_alive = await conn.roundtrip(message)
+        except BaseException:
+            pool.release(scheme, host, port, conn, False)
+            raise
+        pool.release(scheme, host, port, conn, keep_alive)
+        return status, body_len, bytes_out
+
+    async def _hit(self, pool: ConnectionPool, index: int, intended: float, stats: AttackStats, workers: asyncio.Semaphore) -> None:
+        origin = self._corpus.origin(index)
+        sent = time.monotonic()
+        if self._track_arrivals:
+            # Tasks start in the order they were scheduled in, so sends are in order
+            if self._last_sent is not None:
+                stats.arrivals.record(int((sent - self._last_sent) * 1e6))
+            self._last_sent = sent
+        error = ""
+        try:
+            status, bytes_in, bytes_out = await asyncio.wait_for(self._send(pool, index), self._timeout)
+        except asyncio.TimeoutError:
+            status, bytes_in, bytes_out = 0, 0, 0
+            error = f"{origin.method} {origin.url}: timeout exceeded"
+        except (OSError, ValueError, asyncio.IncompleteReadError, asyncio.LimitOverrunError) as e:
+            status, bytes_in, bytes_out = 0, 0, 0
+            error = f"{origin.method} {origin.url}: {e}"
+        finally:
+            workers.release()
+        done = time.monotonic()
+        stats.add(intended, sent, done, status, bytes_in, bytes_out, error)
+        if self._results is not None:
+            self._results.write(self._stage_ids[id(stats)], index, intended, sent, done, status, bytes_in, bytes_out)
+
+    async def _report_every(self, stages: List[AttackStats], current: List[int], on_report: ReportCallback, interval: float) -> None:
+        while True:
+            await asyncio.sleep(interval)
+            stages[current[0]].update_cpu()
+            on_report(stages, current[0])
+
+    @asynccontextmanager
+    async def _session(self, stages: List[AttackStats], current: List[int], on_report: ReportCallback, every: float):
+        pool = self._pool(stages[0])
+        if self._pool_config.prewarm:
+            await pool.prewarm(self._endpoints)
+        reporter = asyncio.create_task(self._report_every(stages, current, on_report, every))
+        reaper = asyncio.create_task(pool.reap_idle())
+        try:
+            yield pool
+        finally:
+            reporter.cancel()
+            reaper.cancel()
+            pool.close()
+        stages[current[0]].update_cpu()
+
+    def _index(self, seq: int, shards: int) -> int:
+        return self._order((seq // shards if self._partitioned else seq) % len(self._corpus))
+
+    async def attack(
+        self,
+        load: Load,
+        on_report: ReportCallback,
+        every: float = 1.0,
+        start: Optional[float] = None,
+        shard: int = 0,
+        shards: int = 1,
+        results: Optional[ResultLog] = None,
+    ) -> List[AttackStats]:
+        profile = None if load.users or load.replay else load.schedule()
+        # Each pass over the corpus walks it in the same seeded order
+        self._order = load.order.permutation(len(self._corpus))
+        stages = [AttackStats(stage.name) for stage in profile.stages] if profile else [AttackStats()]
+        for stats in stages:
+            stats.keys_per_request = self._corpus.keys_per_request
+            if load.detect_warmup:
+                stats.timeline = Timeline()
+        # Index of the stage currently being sent, shared with the reporter
+        current = [0]
+        if results is not None:
+            self._results = results.open([stats.stage for stats in stages])
+            self._stage_ids = {id(stats): i for i, stats in enumerate(stages)}
+        try:
+            async with self._session(stages, current, on_report, every) as pool:
+                loop = asyncio.get_running_loop()
+                if start is None:
+                    start = loop.time()
+                if load.replay is not None:
+                    await self._replay(pool, load.replay, stages[0], start, shard, shards)
+                elif profile is None:
+                    await self._closed_loop(pool, load, stages[0], start, shard, shards)
+                else:
+                    await self._open_loop(pool, profile, load.arrivals, stages, current, start, shard, shards)
+        finally:
+            if self._results is not None:
+                self._results.close()
+                self._results = None
+        return stages
+
+    async def _open_loop(
+        self,
+        pool: ConnectionPool,
+        profile: Profile,
+        arrivals: ArrivalProcess,
+        stages: List[AttackStats],
+        current: List[int],
+        start: float,
+        shard: int,
+        shards: int,
+    ) -> None:
+        workers = asyncio.Semaphore(self._max_workers)
+        in_flight: Set[asyncio.Task] = set()
+        loop = asyncio.get_running_loop()
+        # Sequence numbers are global across shards: shard k owns every k-th one, and draws
+        # its own share of the arrivals, so the shards add up to one stream that follows the
+        # profile. With workers, the Arrivals line shows each worker's share of it.
+        self._track_arrivals = True
+        for i, position in enumerate(arrivals.positions(profile.total, shard, shards)):
+            seq = shard + i * shards
+            # Open loop: each request is due at a fixed offset from the start, regardless of
+            # how long earlier requests are taking
+            offset, stage = profile.locate(position)
+            if stage != current[0]:
+                stages[current[0]].update_cpu()
+                stages[stage].start_cpu()
+                pool.stats = stages[stage].connections
+                current[0] = stage
+            intended = start + offset
+            delay = intended - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            await workers.acquire()
+            task = asyncio.create_task(self._hit(pool, self._index(seq, shards), intended, stages[stage], workers))
+            in_flight.add(task)
+            task.add_done_callback(in_flight.discard)
+        if in_flight:
+            await asyncio.wait(in_flight)
+
+    async def _replay(self, pool: ConnectionPool, replay: Replay, stats: AttackStats, start: float, shard: int, shards: int) -> None:
+        workers = asyncio.Semaphore(self._max_workers)
+        in_flight: Set[asyncio.Task] = set()
+        loop = asyncio.get_running_loop()
+        # Like the open loop, but each request is due at its recorded offset, and only the
+        # requests in flight are held in memory
+        self._track_arrivals = True
+        for seq, record in enumerate(replay.records()):
+            if seq % shards != shard:
+                continue
+            intended = start + record.offset
+            delay = intended - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            await workers.acquire()
+            self._corpus.add(seq, record)
+            task = asyncio.create_task(self._hit(pool, seq, intended, stats, workers))
+            in_flight.add(task)
+            task.add_done_callback(in_flight.discard)
+            task.add_done_callback(lambda _, seq=seq: self._corpus.discard(seq))
+        if in_flight:
+            await asyncio.wait(in_flight)
+
+    async def _closed_loop(self, pool: ConnectionPool, load: Load, stats: AttackStats, start: float, shard: int, shards: int) -> None:
+        users = len(range(shard, load.users, shards))
+        if users == 0:
+            return
+        stats.users = users
+        workers = asyncio.Semaphore(users)
+        seqs = itertools.count(shard, shards)
+        loop = asyncio.get_running_loop()
+        deadline = start + load.duration
+        delay = start - loop.time()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+        # Closed loop: each virtual user waits for its response (and then thinks) before sending
+        # again, so the request rate is whatever the server's latency allows
+        async def user() -> None:
+            while loop.time() < deadline:
+                await workers.acquire()
+                await self._hit(pool, self._index(next(seqs), shards), loop.time(), stats, workers)
+                if load.think_time:
+                    await asyncio.sleep(load.think_time)
+
+        await asyncio.gather(*(user() for _ in range(users)))
+
+
+def write_report(out: TextIO, stages: List[AttackStats], current: int) -> None:
+    stats = stages[current]
+    if len(stages) > 1:
+        out.write(f"Stage {stats.stage}\n")
+    out.write(stats.report())
+    out.flush()
+
+
+def write_final_report(out: TextIO, stages: List[AttackStats]) -> None:
+    if len(stages) == 1:
+        write_report(out, stages, 0)
+        return
+    for stats in stages:
+        out.write(f"\nStage {stats.stage}\n{stats.report()}")
+    out.write("\n" + stage_summary(stages))
+    out.flush()
+
+
+def stage_summary(stages: List[AttackStats]) -> str:
+    width = max(len(stats.stage) for stats in stages)
+    header = ["Requests", "Rate", "p50", "p90", "p99", "p99 corr.", "Success"]
+    lines = [f"{'Stage':<{width}}  " + "  ".join(f"{name:>10}" for name in header)]
+    for stats in stages:
+        total = stats.latencies.total
+        attack = stats.last_sent - stats.first_sent if total else 0.0
+        p50, p90, p99 = stats.latencies.percentiles([50, 90, 99])
+        row = [
+            str(total),
+            f"{total / attack if attack > 0 else 0:.2f}",
+            fmt_duration(p50 / 1e6),
+            fmt_duration(p90 / 1e6),
+            fmt_duration(p99 / 1e6),
+            fmt_duration(stats.corrected.percentile(99) / 1e6),
+            f"{100 * stats.success / total if total else 0:.2f}%",
+        ]
+        lines.append(f"{stats.stage:<{width}}  " + "  ".join(f"{value:>10}" for value in row))
+    return "\n".join(lines) + "\n"
+
+
+def merge_stage_stats(shard_stages: Iterable[List[AttackStats]]) -> List[AttackStats]:
+    shard_stages = list(shard_stages)
+    return [
+        merge_stats((stages[i] for stages in shard_stages), shard_stages[0][i].stage)
+        for i in range(len(shard_stages[0]))
+    ]
+
+
+def trim_warmups(stages: List[AttackStats]) -> None:
+    for stats in stages:
+        if stats.timeline is not None:
+            stats.trim_warmup()
+
+
+def record_warmups(results: Optional[ResultLog], stages: List[AttackStats], workers: int) -> None:
+    # Marks the detected warmup in the raw results, so that the analysis tools leave it out too
+    if results is None or all(stats.warmup_end is None for stats in stages):
+        return
+    wall_offset = time.time() - time.monotonic()
+    ends = [None if stats.warmup_end is None else int((stats.warmup_end + wall_offset) * 1e9) for stats in stages]
+    for log in [results.shard(shard) for shard in range(workers)] if workers > 1 else [results]:
+        log.record_warmup(ends)
+
+
+def without_timelines(stages: List[AttackStats]) -> List[AttackStats]:
+    # Shallow copies for the periodic reports, which don't need the timelines. Those grow with
+    # the run, and only the final report carries them to the parent.
+    copies = []
+    for stats in stages:
+        stats = copy.copy(stats)
+        stats.timeline = None
+        copies.append(stats)
+    return copies
+
+
+def _shard_main(
+    queue: multiprocessing.Queue,
+    shard: int,
+    shards: int,
+    corpus: Union[Corpus, TemplateCorpus, TraceCorpus],
+    load: Load,
+    timeout: float,
+    max_workers: int,
+    pool_config: PoolConfig,
+    partitioned: bool,
+    start: float,
+    results: Optional[ResultLog],
+) -> None:
+    attacker = Attacker(corpus, timeout, max_workers, pool_config, partitioned)
+    on_report = lambda stages, current: queue.put((shard, False, without_timelines(stages), current))
+    stages = asyncio.run(attacker.attack(load, on_report, start=start, shard=shard, shards=shards, results=results))
+    queue.put((shard, True, stages, len(stages) - 1))
+
+
+def run_sharded_attack(
+    corpus: Union[Corpus, TemplateCorpus, TraceCorpus],
+    load: Load,
+    timeout: float,
+    max_workers: int,
+    pool_config: PoolConfig,
+    out: TextIO,
+    workers: int,
+    partitioned: bool,
+    results: Optional[ResultLog] = None,
+) -> List[AttackStats]:
+    if partitioned and len(corpus) < workers:
+        raise Exception(f"Can't partition {len(corpus)} targets across {workers} workers")
+    queue = multiprocessing.Queue()
+    # Every shard schedules against the same start instant (CLOCK_MONOTONIC is system-wide),
+    # leaving time for the processes to come up
+    start = time.monotonic() + SHARD_STARTUP_DELAY
+    # Worker and connection limits apply to the whole run, so each shard gets its share
+    shard_max_workers = -(-max_workers // workers)
+    shard_pool_config = replace(
+        pool_config,
+        max_conns_per_host=-(-pool_config.max_conns_per_host // workers),
+        prewarm=-(-pool_config.prewarm // workers),
+    )
+    procs = []
+    for shard in range(workers):
+        shard_corpus = corpus.shard(shard, workers) if partitioned else corpus
+        proc = multiprocessing.Process(
+            target=_shard_main,
+            args=(
+                queue,
+                shard,
+                workers,
+                shard_corpus,
+                load,
+                timeout,
+                shard_max_workers,
+                shard_pool_config,
+                partitioned,
+                start,
+                results.shard(shard) if results is not None else None,
+            ),
+            daemon=True,
+        )
+        proc.start()
+        procs.append(proc)
+
+    latest: Dict[int, List[AttackStats]] = {}
+    current = 0
+    finished: Set[int] = set()
+    next_report = start + 1.0
+    try:
+        while len(finished) < workers:
+            try:
+                shard, final, stages, shard_current = queue.get(timeout=max(next_report - time.monotonic(), 0.01))
+                latest[shard] = stages
+                current = max(current, shard_current)
+                if final:
+                    finished.add(shard)
+            except queue_module.Empty:
+                for shard, proc in enumerate(procs):
+                    if shard not in finished and not proc.is_alive():
+                        raise Exception(f"Load worker {shard} exited with code {proc.exitcode}")
+            if time.monotonic() >= next_report and latest:
+                write_report(out, merge_stage_stats(latest.values()), current)
+                next_report += 1.0
+    finally:
+        for proc in procs:
+            if proc.is_alive():
+                proc.terminate()
+            proc.join()
+    merged = merge_stage_stats(latest.values())
+    trim_warmups(merged)
+    record_warmups(results, merged, workers)
+    write_final_report(out, merged)
+    return merged
+
+
+def run_attack(
+    corpus: Union[Corpus, TemplateCorpus, TraceCorpus],
+    load: Load,
+    timeout: float,
+    max_workers: int,
+    pool_config: PoolConfig,
+    out: TextIO,
+    workers: int = 1,
+    partitioned: bool = False,
+    results: Optional[ResultLog] = None,
+) -> List[AttackStats]:
+    if workers > 1:
+        return run_sharded_attack(corpus, load, timeout, max_workers, pool_config, out, workers, partitioned, results)
+    attacker = Attacker(corpus, timeout, max_workers, pool_config)
+    stages = asyncio.run(attacker.attack(load, lambda stages, current: write_report(out, stages, current), results=results))
+    trim_warmups(stages)
+    record_warmups(results, stages, 1)
+    write_final_report(out, stages)
+    return stages
@@ -0,0 +1,162 @@
+from bisect import bisect_right
+from dataclasses import dataclass
+import math
+import re
+from typing import List, Tuple
+
+DURATION_UNITS = {"ms": 0.001, "s": 1.0, "m": 60.0, "h": 3600.0}
+PROFILE_HELP = """Comma-separated stages, run back to back:
+  const:RPS:DURATION                 constant rate, e.g. const:500:60s
+  ramp:FROM-TO:DURATION              linear ramp, e.g. ramp:100-2000:2m
+  step:FROM-TO:DURATION:STEPS        staircase of STEPS equal steps, e.g. step:1000-5000:5m:5
+  spike:BASE-PEAK:DURATION:SPIKE     BASE with a SPIKE-long burst to PEAK in the middle, e.g. spike:500-5000:60s:5s
+  sine:LOW-HIGH:DURATION:PERIOD      rate oscillating between LOW and HIGH, starting at LOW, e.g. sine:200-1000:1h:10m"""
+
+
+def parse_duration(text: str) -> float:
+    match = re.fullmatch(r"([0-9.]+)(ms|s|m|h)?", text.strip())
+    if match is None:
+        raise Exception(f"Invalid duration '{text}', expected e.g. 30s, 5m or 1h")
+    return float(match.group(1)) * DURATION_UNITS[match.group(2) or "s"]
+
+
+@dataclass
+class Stage:
+    name: str
+    duration: float  # seconds
+    start_rate: float  # requests per second
+    end_rate: float
+    period: float = 0.0  # sine stages only: seconds per full cycle between start_rate and end_rate
+
+    @property
+    def constant(self) -> bool:
+        return self.period == 0 and self.start_rate == self.end_rate
+
+    def rate_at(self, t: float) -> float:
+        if self.period:
+            mid, amp = (self.start_rate + self.end_rate) / 2, (self.end_rate - self.start_rate) / 2
+            return mid - amp * math.cos(2 * math.pi * t / self.period)
+        return self.start_rate + (self.end_rate - self.start_rate) * t / self.duration
+
+    def count_at(self, t: float) -> float:
+        # Expected number of requests sent in [0, t), i.e. the integral of rate_at
+        if self.period:
+            mid, amp = (self.start_rate + self.end_rate) / 2, (self.end_rate - self.start_rate) / 2
+            return mid * t - amp * self.period / (2 * math.pi) * math.sin(2 * math.pi * t / self.period)
+        if self.start_rate == self.end_rate:
+            # Also covers zero-length stages, e.g. the warmup of a 1-second run
+            return self.start_rate * t
+        return self.start_rate * t + (self.end_rate - self.start_rate) * t * t / (2 * self.duration)
+
+    def time_at(self, count: float) -> float:
+        # Inverse of count_at: when the count-th request is due
+        if count <= 0:
+            return 0.0
+        if self.period:
+            return self._solve(count)
+        if self.start_rate == self.end_rate:
+            return count / self.start_rate
+        a = (self.end_rate - self.start_rate) / (2 * self.duration)
+        b = self.start_rate
+        return min(2 * count / (b + math.sqrt(max(b * b + 4 * a * count, 0.0))), self.duration)
+
+    def _solve(self, count: float) -> float:
+        # Newton's method, falling back to bisection where the rate is too close to zero
+        lo, hi = 0.0, self.duration
+        t = min(count / max((self.start_rate + self.end_rate) / 2, 1e-9), hi)
+        for _ in range(64):
+            err = self.count_at(t) - count
+            if abs(err) < 1e-9:
+                break
+            if err > 0:
+                hi = t
+            else:
+                lo = t
+            rate = self.rate_at(t)
+            t_next = t - err / rate if rate > 1e-9 else -1.0
+            t = t_next if lo < t_next < hi else (lo + hi) / 2
+        return t
+
+
+class Profile:
+    def __init__(self, stages: List[Stage]):
+        if len(stages) == 0:
+            raise Exception("A load profile needs at least one stage")
+        self.stages = stages
+        self.starts = [0.0]
+        self.counts = [0.0]
+        for stage in stages:
+            self.starts.append(self.starts[-1] + stage.duration)
+            self.counts.append(self.counts[-1] + stage.count_at(stage.duration))
+
+    @staticmethod
+    def constant(rate: float, duration: float) -> "Profile":
+        return Profile([Stage(f"const {rate:g}rps", duration, rate, rate)])
+
+    @property
+    def duration(self) -> float:
+        return self.starts[-1]
+
+    @property
+    def total(self) -> int:
+        return int(self.counts[-1] + 1e-9)
+
+    @property
+    def piecewise_constant(self) -> bool:
+        return all(stage.constant for stage in self.stages)
+
+    def locate(self, count: float) -> Tuple[float, int]:
+        # Maps a position in the request sequence to (seconds since start, stage index)
+        index = min(bisect_right(self.counts, count) - 1, len(self.stages) - 1)
+        return self.starts[index] + self.stages[index].time_at(count - self.counts[index]), index
+
+
+def _rates(text: str) -> Tuple[float, float]:
+    low, sep, high = text.partition("-")
+    if not sep:
+        raise Exception(f"Expected FROM-TO rates, got '{text}'")
+    return float(low), float(high)
+
+
+def parse_profile(text: str) -> Profile:
+    stages = []
+    for spec in text.split(","):
+        kind, *fields = spec.strip().split(":")
+        try:
+            if kind == "const" and len(fields) == 2:
+                rate = float(fields[0])
+                stages.append(Stage(f"const {rate:g}rps", parse_duration(fields[1]), rate, rate))
+            elif kind == "ramp" and len(fields) == 2:
+                start, end = _rates(fields[0])
+                stages.append(Stage(f"ramp {start:g}-{end:g}rps", parse_duration(fields[1]), start, end))
+            elif kind == "step" and len(fields) == 3:
+                start, end = _rates(fields[0])
+                steps = int(fields[2])
+                if steps < 2:
+                    raise Exception("a staircase needs at least 2 steps")
+                step_duration = parse_duration(fields[1]) / steps
+                for i in range(steps):
+                    rate = start + (end - start) * i / (steps - 1)
+                    stages.append(Stage(f"step {i + 1}/{steps} {rate:g}rps", step_duration, rate, rate))
+            elif kind == "spike" and len(fields) == 3:
+                base, peak = _rates(fields[0])
+                duration, spike = parse_duration(fields[1]), parse_duration(fields[2])
+                if spike >= duration:
+                    raise Exception("the spike must be shorter than the stage")
+                around = (duration - spike) / 2
+                stages.append(Stage(f"spike before {base:g}rps", around, base, base))
+                stages.append(Stage(f"spike peak {peak:g}rps", spike, peak, peak))
+                stages.append(Stage(f"spike after {base:g}rps", around, base, base))
+            elif kind == "sine" and len(fields) == 3:
+                low, high = _rates(fields[0])
+                stages.append(Stage(f"sine {low:g}-{high:g}rps", parse_duration(fields[1]), low, high, parse_duration(fields[2])))
+            else:
+                raise Exception("unknown stage type or wrong number of fields")
+        except Exception as e:
+            raise Exception(f"Invalid load profile stage '{spec}': {e}")
+    for stage in stages:
+        if stage.duration <= 0 or min(stage.start_rate, stage.end_rate) < 0:
+            raise Exception(f"Load profile stage '{stage.name}' needs a positive duration and non-negative rates")
+    for i, stage in enumerate(stages):
+        stage.name = f"#{i + 1} {stage.name}"
+    return Profile(stages)
@@ -0,0 +1,14 @@
+import json
+from pathlib import Path
+from typing import Dict, List
+
+MANIFEST_FILE = Path(__file__).parent / "feature_services.json"
+
+
+def load_manifest() -> Dict[str, List[str]]:
+    # Feature service name -> join keys, as written by gen_feature_services.py alongside
+    # feature_services.py. Reading it doesn't need the Tecton SDK.
+    if not MANIFEST_FILE.exists():
+        raise Exception(f"{MANIFEST_FILE.name} not found. Run `gen_feature_services.py` first.")
+    manifest = json.loads(MANIFEST_FILE.read_text())
+    return {fs["name"]: fs["join_keys"] for fs in manifest["feature_services"]}
@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+import argparse
+from pathlib import Path
+from typing import List
+
+from histogram_file import LABELS, HistogramRecord, merge_records, read_histogram_file, write_histogram_file
+from load_engine import fmt_duration
+
+QUANTILES = [50, 90, 99, 99.9]
+
+
+def row(name: str, record: HistogramRecord) -> List[str]:
+    total = record.latencies.total
+    duration = record.last - record.first if record.first is not None else 0.0
+    return [
+        name,
+        str(total),
+        f"{total / duration if duration > 0 else 0:.2f}",
+        *(fmt_duration(value / 1e6) for value in record.latencies.percentiles(QUANTILES) + [record.latencies.max]),
+        fmt_duration(record.corrected.percentile(99) / 1e6),
+        f"{100 * record.success / total if total else 0:.2f}%",
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Combine the .hist files of any set of runs, e.g. the concurrent ones of run_vegeta_all.sh, into exact aggregate percentiles",
+    )
+    parser.add_argument("files", type=Path, nargs="+", help="Histogram files written by `run_vegeta.py --file`")
+    parser.add_argument(
+        "--by",
+        type=str,
+        help=f"Comma-separated labels to group by, out of {', '.join(LABELS)} (empty for a single total)",
+        default="service,phase,stage",
+    )
+    parser.add_argument("-o", "--output", type=Path, help="Also write the merged histograms to this .hist file", default=None)
+    args = parser.parse_args()
+    by = [label.strip() for label in args.by.split(",") if label.strip()]
+    for label in by:
+        if label not in LABELS:
+            raise Exception(f"Unknown label '{label}', expected one of {LABELS}")
+
+    records = [record for path in args.files for record in read_histogram_file(path)]
+    groups = merge_records(records, by)
+    rows = [row(" ".join(value for value in key if value) or "All", record) for key, record in groups.items()]
+    if len(groups) > 1:
+        rows.append(row("Total", next(iter(merge_records(records, []).values()))))
+    header = [" ".join(by) or "Group", "Requests", "Rate", *(f"p{q:g}" for q in QUANTILES), "max", "p99 corr.", "Success"]
+    width = max(len(line[0]) for line in [header] + rows)
+    for line in [header] + rows:
+        print(f"{line[0]:<{width}}  " + "  ".join(f"{value:>10}" for value in line[1:]))
+    if args.output is not None:
+        write_histogram_file(args.output, list(groups.values()))
+
+
+if __name__ == '__main__':
+    main()
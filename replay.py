@@ -0,0 +1,104 @@
+from dataclasses import dataclass
+from datetime import datetime
+import json
+from pathlib import Path
+import sys
+from typing import Any, Dict, Iterator, Optional, Tuple
+
+from corpus import Origin
+from gen_requests import req_params
+
+# Trace format: one JSON object per line, in the order the requests were logged, e.g.
+#   {"timestamp": "2024-05-01T12:00:00.125Z", "feature_service": "fs_mixed_5_feature_views",
+#    "join_keys": {"cust_id": "17", "merchant_id": "4"}}
+# The timestamp is either seconds since the epoch (fractions allowed) or an ISO 8601 string.
+
+
+def parse_timestamp(value: Any) -> float:
+    if isinstance(value, (int, float)):
+        return float(value)
+    if isinstance(value, str):
+        return datetime.fromisoformat(value.replace("Z", "+00:00")).timestamp()
+    raise Exception(f"Invalid timestamp {value!r}, expected epoch seconds or an ISO 8601 string")
+
+
+@dataclass
+class TraceRecord:
+    offset: float  # seconds after the first record, divided by the time scale
+    feature_service: str
+    join_keys: Dict[str, str]
+
+
+@dataclass
+class Replay:
+    # What to replay. Picklable, so that every shard can stream the trace itself.
+    path: Path
+    time_scale: float = 1.0  # 2 replays twice as fast as recorded
+    feature_service: Optional[str] = None  # only replay this service's records
+
+    def records(self) -> Iterator[TraceRecord]:
+        # Streamed line by line: memory stays flat however long the trace is
+        first = None
+        with open(self.path, "r", encoding="utf-8") as f:
+            for line_no, line in enumerate(f, 1):
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    raw = json.loads(line)
+                    timestamp = parse_timestamp(raw["timestamp"])
+                    feature_service = raw["feature_service"]
+                    join_keys = {name: str(value) for name, value in raw["join_keys"].items()}
+                except Exception as e:
+                    raise Exception(f"{self.path}:{line_no}: invalid trace record: {e}")
+                if first is None:
+                    first = timestamp
+                if self.feature_service is not None and feature_service != self.feature_service:
+                    continue
+                yield TraceRecord((timestamp - first) / self.time_scale, feature_service, join_keys)
+
+    def describe(self) -> str:
+        speed = "" if self.time_scale == 1 else f" at {self.time_scale:g}x speed"
+        service = "" if self.feature_service is None else f" ({self.feature_service} only)"
+        return f"{self.path}{service}{speed}"
+
+
+class TraceCorpus:
+    # Same interface as Corpus, for the requests of a replay currently in flight: the replay
+    # loop adds request seq's body just before sending it and discards it once it's done
+    def __init__(self, origin: Origin, ws_name: str):
+        self.origins = [origin]
+        self.keys_per_request = 1
+        self._head = origin.http1_head()
+        self._ws_name = ws_name
+        self._bodies: Dict[int, bytes] = {}
+
+    def __len__(self) -> int:
+        # Indices are sequence numbers in the trace, never wrapped
+        return sys.maxsize
+
+    def add(self, index: int, record: TraceRecord) -> None:
+        params = req_params(record.feature_service, self._ws_name, record.join_keys)
+        self._bodies[index] = json.dumps(params).encode("utf-8")
+
+    def discard(self, index: int) -> None:
+        self._bodies.pop(index, None)
+
+    def origin_id(self, index: int) -> int:
+        return 0
+
+    def origin(self, index: int) -> Origin:
+        return self.origins[0]
+
+    def body(self, index: int) -> bytes:
+        return self._bodies[index]
+
+    def body_len(self, index: int) -> int:
+        return len(self._bodies[index])
+
+    def request(self, index: int, buffer: Optional[bytearray] = None) -> Tuple[memoryview, int]:
+        body = self._bodies[index]
+        return memoryview(self._head + b"Content-Length: %d\r\n\r\n" % len(body) + body), len(body)
+
+    def shard(self, shard: int, shards: int) -> "TraceCorpus":
+        raise Exception("A replay can't be partitioned: every worker reads the whole trace and sends its share")
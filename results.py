@@ -0,0 +1,401 @@
+from array import array
+import csv
+from dataclasses import dataclass, field, replace
+import heapq
+import json
+import os
+from pathlib import Path
+import shutil
+import struct
+import subprocess
+import sys
+import time
+from typing import BinaryIO, Dict, Iterable, Iterator, List, NamedTuple, Optional, Tuple, Union
+
+from histogram import Histogram
+
+# Raw results file layout, as written by the asyncio engine:
+#   MAGIC, then the header length as a little-endian uint32, then the JSON header
+#   {"phase": ..., "stages": [...]}, then one RECORD per request in completion order:
+#   send time (ns since the epoch), latency and corrected latency (µs), status code,
+#   stage index, bytes in and bytes out. The header is padded with room for "warmup_end",
+#   added after the run when a warmup was detected: per stage, the send time (ns since the
+#   epoch) its steady state starts at, or null.
+MAGIC = b"BRES\x01"
+SUFFIX = ".results"
+VEGETA_SUFFIX = ".bin"  # vegeta's own gob-encoded results
+RECORD = struct.Struct("<qIIHHII")
+FLUSH_RECORDS = 16384  # records buffered per write
+READ_RECORDS = 65536  # records decoded per read
+MAX_FIELD = 2**32 - 1
+# Results are written when their response arrives, so they come in roughly, not exactly, in
+# send order. An interval is reported once results this much newer have been seen.
+INTERVAL_GRACE = 300.0  # seconds
+
+# Columnar results directory (<name>.columns): one NumPy .npy file per column, plus
+# meta.json with the run's labels and stage names (and "warmup_end", as above). Written with the standard library only, so
+# the load driver doesn't need numpy. analysis.py reads them.
+COLUMNS_SUFFIX = ".columns"
+META_FILE = "meta.json"
+# Column -> array typecode. key is the index of the request in the corpus (the trace position
+# for replays, vegeta's sequence number for vegeta runs), -1 where unknown.
+COLUMNS = {
+    "timestamp": "q",  # send time, ns since the epoch
+    "latency": "I",  # µs
+    "corrected": "I",  # µs
+    "status": "H",
+    "stage": "H",  # index into meta.json's stages
+    "bytes_in": "I",
+    "bytes_out": "I",
+    "key": "q",
+}
+NPY_HEADER_SIZE = 128  # bytes, with room for any row count
+NPY_TYPES = {"q": "i8", "I": "u4", "H": "u2"}
+
+
+class Result(NamedTuple):
+    timestamp: float  # seconds since the epoch the request was sent
+    latency: int  # microseconds
+    corrected: int  # microseconds, from the intended send time (the same as latency for vegeta)
+    status: int  # 0 for requests that got no response
+    bytes_in: int
+    bytes_out: int
+    phase: str
+    stage: str
+    key: int = -1  # see COLUMNS
+
+
+@dataclass
+class ResultLog:
+    # Where a run's raw results go, as records (a .results file) or columns (a .columns
+    # directory). Picklable, so that each shard opens its own.
+    path: Path
+    phase: str
+    format: str = "records"
+    labels: Dict[str, str] = field(default_factory=dict)  # columns only: service, phase, ...
+
+    def shard(self, shard: int) -> "ResultLog":
+        return replace(self, path=self.path.with_name(f"{self.path.stem}.w{shard}{self.path.suffix}"))
+
+    def open(self, stages: List[str]) -> Union["ResultWriter", "ColumnWriter"]:
+        if self.format == "columns":
+            return ColumnWriter(self.path, {"run": self.phase, "stages": stages, "labels": self.labels})
+        return ResultWriter(self.path, self.phase, stages)
+
+    def record_warmup(self, ends: List[Optional[int]]) -> None:
+        # Adds the warmup detected after the run (see the file layouts above) to its results
+        if self.format == "columns":
+            meta_path = self.path / META_FILE
+            meta = json.loads(meta_path.read_text(encoding="utf-8"))
+            meta["warmup_end"] = ends
+            meta_path.write_text(json.dumps(meta), encoding="utf-8")
+            return
+        with open(self.path, "r+b") as f:
+            f.seek(len(MAGIC))
+            header_len = int.from_bytes(f.read(4), "little")
+            header = json.loads(f.read(header_len))
+            header["warmup_end"] = ends
+            text = json.dumps(header).encode("utf-8")
+            if len(text) > header_len:
+                raise Exception(f"{self.path}: no room left in the header for the warmup")
+            f.seek(len(MAGIC) + 4)
+            f.write(text.ljust(header_len))
+
+
+class ResultWriter:
+    def __init__(self, path: Path, phase: str, stages: List[str]):
+        self._file = open(path, "wb")
+        header = json.dumps({"phase": phase, "stages": stages}).encode("utf-8")
+        header = header.ljust(len(header) + len(json.dumps({"warmup_end": [-(2**63)] * len(stages)})))
+        self._file.write(MAGIC + len(header).to_bytes(4, "little") + header)
+        # The engine's clock is monotonic. Records carry wall-clock send times, so that files
+        # written by different processes and hosts line up.
+        self._wall_offset = time.time() - time.monotonic()
+        self._buffer = bytearray()
+        self._pending = 0
+
+    def write(
+        self, stage: int, key: int, intended: float, sent: float, done: float, status: int, bytes_in: int, bytes_out: int
+    ) -> None:
+        self._buffer += RECORD.pack(
+            int((sent + self._wall_offset) * 1e9),
+            min(int((done - sent) * 1e6), MAX_FIELD),
+            min(int((done - min(intended, sent)) * 1e6), MAX_FIELD),
+            status,
+            stage,
+            min(bytes_in, MAX_FIELD),
+            min(bytes_out, MAX_FIELD),
+        )
+        self._pending += 1
+        if self._pending >= FLUSH_RECORDS:
+            self.flush()
+
+    def flush(self) -> None:
+        self._file.write(self._buffer)
+        self._buffer.clear()
+        self._pending = 0
+
+    def close(self) -> None:
+        self.flush()
+        self._file.close()
+
+
+class _NpyFile:
+    # A one-dimensional .npy file streamed to disk. The header's row count is rewritten on every
+    # write, though a killed run can still leave rows past it (analysis.py reads those too).
+    def __init__(self, path: Path, typecode: str):
+        self._file = open(path, "wb")
+        self._descr = ("<" if sys.byteorder == "little" else ">") + NPY_TYPES[typecode]
+        self.rows = 0
+        self._file.write(self._header())
+
+    def _header(self) -> bytes:
+        text = f"{{'descr': '{self._descr}', 'fortran_order': False, 'shape': ({self.rows},), }}"
+        text = text.ljust(NPY_HEADER_SIZE - 11) + "\n"
+        return b"\x93NUMPY\x01\x00" + len(text).to_bytes(2, "little") + text.encode("latin-1")
+
+    def write(self, values: array) -> None:
+        self._file.write(values.tobytes())
+        self.rows += len(values)
+        self._file.seek(0)
+        self._file.write(self._header())
+        self._file.seek(0, os.SEEK_END)
+
+    def close(self) -> None:
+        self._file.close()
+
+
+class ColumnWriter:
+    # Same interface as ResultWriter, writing a columnar results directory instead
+    def __init__(self, path: Path, meta: Dict):
+        path.mkdir(parents=True, exist_ok=True)
+        (path / META_FILE).write_text(json.dumps(meta), encoding="utf-8")
+        self._files = {name: _NpyFile(path / f"{name}.npy", typecode) for name, typecode in COLUMNS.items()}
+        self._buffers = {name: array(typecode) for name, typecode in COLUMNS.items()}
+        self._wall_offset = time.time() - time.monotonic()
+
+    def _append(self, row: Tuple[int, ...]) -> None:
+        for buffer, value in zip(self._buffers.values(), row):
+            buffer.append(value)
+        if len(self._buffers["timestamp"]) >= FLUSH_RECORDS:
+            self.flush()
+
+    def write(
+        self, stage: int, key: int, intended: float, sent: float, done: float, status: int, bytes_in: int, bytes_out: int
+    ) -> None:
+        self._append((
+            int((sent + self._wall_offset) * 1e9),
+            min(int((done - sent) * 1e6), MAX_FIELD),
+            min(int((done - min(intended, sent)) * 1e6), MAX_FIELD),
+            status,
+            stage,
+            min(bytes_in, MAX_FIELD),
+            min(bytes_out, MAX_FIELD),
+            key,
+        ))
+
+    def add(self, result: Result, stage: int = 0) -> None:
+        # For results decoded after the fact, e.g. vegeta's
+        self._append((
+            int(result.timestamp * 1e9),
+            min(result.latency, MAX_FIELD),
+            min(result.corrected, MAX_FIELD),
+            result.status,
+            stage,
+            min(result.bytes_in, MAX_FIELD),
+            min(result.bytes_out, MAX_FIELD),
+            result.key,
+        ))
+
+    def flush(self) -> None:
+        for name, buffer in self._buffers.items():
+            self._files[name].write(buffer)
+            del buffer[:]
+
+    def close(self) -> None:
+        self.flush()
+        for npy_file in self._files.values():
+            npy_file.close()
+
+
+def _iter_raw(path: Path, f: BinaryIO, include_warmup: bool) -> Iterator[Result]:
+    header_len = int.from_bytes(f.read(4), "little")
+    header = json.loads(f.read(header_len))
+    phase, stages = header["phase"], header["stages"]
+    # Send times before which each stage's results are warmup
+    ends = [0 if include_warmup or end is None else end for end in header.get("warmup_end", [None] * len(stages))]
+    leftover = b""
+    while True:
+        chunk = f.read(READ_RECORDS * RECORD.size)
+        if not chunk:
+            break
+        chunk = leftover + chunk
+        end = len(chunk) - len(chunk) % RECORD.size
+        for sent_ns, latency, corrected, status, stage, bytes_in, bytes_out in RECORD.iter_unpack(chunk[:end]):
+            if sent_ns < ends[stage]:
+                continue
+            yield Result(sent_ns / 1e9, latency, corrected, status, bytes_in, bytes_out, phase, stages[stage])
+        leftover = chunk[end:]
+    if leftover:
+        # A run that was killed can leave half a record at the end
+        print(f"{path}: ignoring a truncated record at the end", file=sys.stderr)
+
+
+def _iter_vegeta_csv(lines: Iterable[str], phase: str) -> Iterator[Result]:
+    # Columns of `vegeta encode --to=csv`: timestamp (ns), code, latency (ns), bytes out,
+    # bytes in, error, base64 body, attack, seq, method, url, headers
+    csv.field_size_limit(sys.maxsize)
+    for row in csv.reader(lines):
+        latency = int(row[2]) // 1000
+        yield Result(int(row[0]) / 1e9, latency, latency, int(row[1]), int(row[4]), int(row[3]), phase, "", int(row[8]))
+
+
+def iter_results(path: Path, include_warmup: bool = False) -> Iterator[Result]:
+    # Streams a raw results file of either engine: memory stays flat however many there are.
+    # Requests sent during a detected warmup are left out, like from the run's own report.
+    with open(path, "rb") as f:
+        if f.read(len(MAGIC)) == MAGIC:
+            yield from _iter_raw(path, f, include_warmup)
+            return
+    if path.suffix == ".csv":
+        with open(path, "r", encoding="utf-8", newline="") as f:
+            yield from _iter_vegeta_csv(f, path.stem)
+        return
+    if shutil.which("vegeta") is None:
+        raise Exception(f"Decoding {path} needs vegeta. Or convert it elsewhere with `vegeta encode --to=csv`")
+    proc = subprocess.Popen(["vegeta", "encode", "--to=csv", str(path)], stdout=subprocess.PIPE, encoding="utf-8", newline="")
+    try:
+        yield from _iter_vegeta_csv(proc.stdout, path.stem)
+    finally:
+        proc.stdout.close()
+        proc.wait()
+
+
+def merge_results(paths: Iterable[Path], include_warmup: bool = False) -> Iterator[Result]:
+    # Every file's results, approximately in send order
+    return heapq.merge(*(iter_results(path, include_warmup) for path in paths), key=lambda result: result.timestamp)
+
+
+class _Bucket:
+    def __init__(self):
+        self.latencies = Histogram()
+        self.success = 0
+        self.first = 0.0
+        self.last = 0.0
+
+    def add(self, result: Result) -> None:
+        if self.latencies.total == 0 or result.timestamp < self.first:
+            self.first = result.timestamp
+        self.last = max(self.last, result.timestamp)
+        self.latencies.record(result.latency)
+        if 200 <= result.status < 400:
+            self.success += 1
+
+    def row(self, label: str, duration: Optional[float] = None) -> List[str]:
+        from load_engine import fmt_duration
+
+        total = self.latencies.total
+        if duration is None:
+            duration = self.last - self.first
+        p50, p90, p99 = self.latencies.percentiles([50, 90, 99])
+        return [
+            label,
+            str(total),
+            f"{total / duration if duration > 0 else 0:.2f}",
+            *(fmt_duration(value / 1e6) for value in [p50, p90, p99, self.latencies.max]),
+            f"{100 * self.success / total if total else 0:.2f}%",
+        ]
+
+
+def _table(title: str, rows: List[List[str]]) -> str:
+    header = [title, "Requests", "Rate", "p50", "p90", "p99", "max", "Success"]
+    width = max(len(row[0]) for row in [header] + rows)
+    lines = [f"{header[0]:<{width}}  " + "  ".join(f"{name:>10}" for name in header[1:])]
+    lines += [f"{row[0]:<{width}}  " + "  ".join(f"{value:>10}" for value in row[1:]) for row in rows]
+    return "\n".join(lines) + "\n"
+
+
+class ResultSummary:
+    # Folds results into histograms as they stream past: overall, per interval, per phase
+    # (and stage within it) and per status code. Intervals are reported and dropped as the
+    # stream moves on, so memory depends on neither the number of results nor the run length.
+    def __init__(self, every: float = 1.0):
+        self.every = every
+        self.latencies = Histogram()
+        self.corrected = Histogram()
+        self.success = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.first: Optional[float] = None
+        self.last = 0.0
+        self.phases: Dict[Tuple[str, str], _Bucket] = {}
+        self.statuses: Dict[int, _Bucket] = {}
+        self._intervals: Dict[int, _Bucket] = {}
+        self._interval_rows: List[List[str]] = []
+        self._reported = -1  # intervals up to this one have been reported
+        self.late = 0  # results whose interval had already been reported
+
+    def add(self, result: Result) -> None:
+        if self.first is None:
+            self.first = result.timestamp
+        self.first = min(self.first, result.timestamp)
+        self.last = max(self.last, result.timestamp)
+        self.latencies.record(result.latency)
+        self.corrected.record(result.corrected)
+        if 200 <= result.status < 400:
+            self.success += 1
+        self.bytes_in += result.bytes_in
+        self.bytes_out += result.bytes_out
+        for buckets, key in ((self.phases, (result.phase, result.stage)), (self.statuses, result.status)):
+            bucket = buckets.get(key)
+            if bucket is None:
+                bucket = buckets[key] = _Bucket()
+            bucket.add(result)
+        if self.every:
+            self._add_interval(result)
+
+    def _add_interval(self, result: Result) -> None:
+        interval = int(result.timestamp // self.every)
+        if interval <= self._reported:
+            self.late += 1
+            return
+        bucket = self._intervals.get(interval)
+        if bucket is None:
+            bucket = self._intervals[interval] = _Bucket()
+        bucket.add(result)
+        self._report_intervals(int((result.timestamp - INTERVAL_GRACE) // self.every))
+
+    def _report_intervals(self, up_to: int) -> None:
+        # Only the row is kept of an interval that's done
+        if up_to <= self._reported:
+            return
+        for interval in sorted(key for key in self._intervals if key <= up_to):
+            bucket = self._intervals.pop(interval)
+            offset = interval * self.every - self.first
+            self._interval_rows.append(bucket.row(f"+{max(offset, 0):.0f}s", self.every))
+        self._reported = up_to
+
+    def report(self) -> str:
+        from load_engine import fmt_latencies
+
+        self._report_intervals(max(self._intervals, default=self._reported))
+        total = self.latencies.total
+        duration = self.last - self.first if total else 0.0
+        codes = "  ".join(f"{code}:{bucket.latencies.total}" for code, bucket in sorted(self.statuses.items()))
+        sections = ["\n".join([
+            f"Requests      [total, rate]  {total}, {total / duration if duration > 0 else 0:.2f}",
+            f"Latencies     [min, mean, 50, 90, 95, 99, max]  {fmt_latencies(self.latencies)}",
+            f"Corrected     [min, mean, 50, 90, 95, 99, max]  {fmt_latencies(self.corrected)}",
+            f"Bytes In      [total, mean]  {self.bytes_in}, {self.bytes_in / total if total else 0:.2f}",
+            f"Bytes Out     [total, mean]  {self.bytes_out}, {self.bytes_out / total if total else 0:.2f}",
+            f"Success       [ratio]  {100 * self.success / total if total else 0:.2f}%",
+            f"Status Codes  [code:count]  {codes}",
+        ]) + "\n"]
+        phase_rows = [bucket.row(f"{phase} {stage}".strip()) for (phase, stage), bucket in self.phases.items()]
+        sections.append(_table("Phase", phase_rows))
+        sections.append(_table("Status", [bucket.row(str(code)) for code, bucket in sorted(self.statuses.items())]))
+        if self.every:
+            sections.append(_table(f"Every {self.every:g}s", self._interval_rows))
+            if self.late:
+                sections.append(f"{self.late} results arrived after their interval was reported\n")
+        return "\n".join(sections)
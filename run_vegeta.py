@@ -1,16 +1,35 @@
 #!/usr/bin/env python3
 import argparse
+from fractions import Fraction
 from functools import lru_cache
+import json
 import os
+import random
+import socket
 from pathlib import Path
-from typing import List, Tuple
+from typing import Dict, List, Optional, Tuple, Union
 import subprocess
 import sys
+import time
 
-from gen_requests import REQS_DIR
+from histogram_file import SUFFIX as HISTOGRAM_SUFFIX, HistogramRecord, records_from_results, write_histogram_file
+from gen_requests import REQS_DIR, RequestFile, add_key_arguments, api_url, key_distribution, request_file_names
+from arrivals import ARRIVALS, ArrivalProcess
+from corpus import Corpus, Origin, SynthesizedCorpus, TemplateCorpus, endpoint, load_corpus
+from keyspace import ORDERS, KeySampler, KeySpace, Ordering, parse_cardinalities
+from load_engine import AttackStats, Load, PoolConfig, request_headers, run_attack
+from load_profile import PROFILE_HELP, parse_profile
+from manifest import load_manifest
+from replay import Replay, TraceCorpus
+from results import COLUMNS_SUFFIX, SUFFIX as RESULTS_SUFFIX, VEGETA_SUFFIX, ResultLog, iter_results
+from target_file import is_target_file
+from warmup import WARMUP_MODES
 
 VEGET_OUT_FOLDERNAME = "vegeta_out"
 VEGETA_OUT_DIR = Path(__file__).parent / VEGET_OUT_FOLDERNAME
+ENGINE_NAMES = {"vegeta": "Vegeta", "asyncio": "the asyncio engine"}
+ENGINES = list(ENGINE_NAMES)
+HTTP_VERSIONS = ["1.1", "2"]
 
 class ReqUtil:
     @staticmethod
@@ -36,89 +55,486 @@ class ReqUtil:
         return res.returncode
 
     @staticmethod
-    def shell_pipe(cmd_parts_1: List[str], cmd_parts_2: List[str]) -> None:
+    def shell_pipe(cmd_parts_1: List[str], cmd_parts_2: List[str], tee: Optional[Path] = None) -> None:
+        # With tee, the first command's output is also saved to that file
         ps1 = subprocess.Popen(cmd_parts_1, stdout=subprocess.PIPE)
-        ps2 = subprocess.Popen(cmd_parts_2, stdin=ps1.stdout, stdout=sys.stdout)
-        ps1.wait()
-        ps2.wait()
+        procs = [ps1]
+        if tee is not None:
+            procs.append(subprocess.Popen(["tee", str(tee)], stdin=procs[-1].stdout, stdout=subprocess.PIPE))
+        procs.append(subprocess.Popen(cmd_parts_2, stdin=procs[-1].stdout, stdout=sys.stdout))
+        for proc in procs:
+            proc.wait()
+
+def first_target_url(req_file: Path) -> str:
+    with open(req_file, "r", encoding="utf-8") as f:
+        return json.loads(f.readline())["url"]
+
+
+def vegeta_rate(rate: float) -> str:
+    # Vegeta takes a request count per duration. Whole counts keep fractional rates exact
+    # (0.3 RPS is 3/10s): rounding them could give 0, which vegeta reads as unlimited.
+    fraction = Fraction(rate).limit_denominator(10**6)
+    if fraction <= 0:
+        raise Exception(f"Vegeta can't send {rate:g} RPS: a rate of 0 means unlimited to it")
+    return f"{fraction.numerator}/{fraction.denominator}s"
+
+
+def vegeta_phase(
+    req_file: Path,
+    api_key: str,
+    load: Load,
+    timeout: int,
+    out_file: Optional[Path],
+    max_workers: int,
+    pool_config: PoolConfig,
+    http_version: Optional[str],
+    results_file: Optional[Path] = None,
+) -> None:
+    # Vegeta's closed-loop mode: no rate limit, a fixed number of workers
+    rate_flag = "--rate=0" if load.users else f"--rate={vegeta_rate(load.rate)}"
+    cmd_attack = [
+        "vegeta",
+        "attack",
+        "--format=json",
+        f"--targets={req_file}",
+        f"--timeout={timeout}ms",
+        rate_flag,
+        f"--max-workers={max_workers}",
+        f"--duration={load.duration}s",
+        f"--header=Authorization: Tecton-key {api_key}",
+        f"--keepalive={str(pool_config.keepalive).lower()}",
+    ]
+    if load.users:
+        cmd_attack[cmd_attack.index(f"--max-workers={max_workers}")] = f"--max-workers={load.users}"
+        cmd_attack.append(f"--workers={load.users}")
+    if pool_config.max_conns_per_host:
+        cmd_attack.append(f"--max-connections={pool_config.max_conns_per_host}")
+    if http_version is not None:
+        cmd_attack.append(f"--http2={str(http_version == '2').lower()}")
+        if http_version == "2" and first_target_url(req_file).startswith("http://"):
+            cmd_attack.append("--h2c")
+    cmd_report = [
+        "vegeta",
+        "report",
+        "--every=1s",
+    ]
+    if out_file is not None:
+        cmd_report.append(f"--output={out_file}")
+    ReqUtil.shell_pipe(cmd_attack, cmd_report, results_file)
+
+
+def synthesized_corpus(args: argparse.Namespace, seed: int, headers: Dict[str, str]) -> SynthesizedCorpus:
+    # Builds request bodies at send time from the service's template instead of a request file
+    cluster_url, ws_name = args.synthesize
+    feature_services = load_manifest()
+    if args.service not in feature_services:
+        raise Exception(f"Unknown feature service '{args.service}', expected one of {sorted(feature_services)}")
+    distribution = key_distribution(args, seed)
+    key_space = KeySpace(parse_cardinalities(args.cardinality)).subspace(feature_services[args.service])
+    req_file = RequestFile(
+        cluster_url,
+        args.service,
+        ws_name,
+        dict(zip(key_space.names, key_space.cardinalities)),
+        distribution,
+        None,
+        args.batch_size,
+    )
+    origin = post_origin(req_file.api_url, headers)
+    return SynthesizedCorpus(origin, req_file.template(), KeySampler(distribution, key_space), args.batch_size or 1)
+
+
+def post_origin(url: str, headers: Dict[str, str]) -> Origin:
+    scheme, host, port, path = endpoint(url)
+    return Origin("POST", url, scheme, host, port, path, headers)
+
+
+def asyncio_phase(
+    corpus: Union[Corpus, TemplateCorpus, TraceCorpus],
+    load: Load,
+    timeout: int,
+    out_file: Optional[Path],
+    max_workers: int,
+    pool_config: PoolConfig,
+    workers: int,
+    partitioned: bool,
+    results: Optional[ResultLog] = None,
+) -> List[AttackStats]:
+    if out_file is None:
+        return run_attack(corpus, load, timeout / 1000, max_workers, pool_config, sys.stdout, workers, partitioned, results)
+    with open(out_file, "w", encoding="utf-8") as out:
+        return run_attack(corpus, load, timeout / 1000, max_workers, pool_config, out, workers, partitioned, results)
+
 
 def main():
     # Check the requests directory
     REQS_DIR.mkdir(parents=True, exist_ok=True)
-    req_filenames = [req_file.name for req_file in REQS_DIR.iterdir()]
-    if len(req_filenames) == 0:
-        raise Exception(f"No request files in {REQS_DIR}. Run `gen_requests.py` first.")
+    req_filenames = request_file_names()
 
-    parser = argparse.ArgumentParser()
+    parser = argparse.ArgumentParser(
+        epilog=f"Load profiles (--profile):\n{PROFILE_HELP}",
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
     parser.add_argument("-r", "--rps", type=int, help="Requests per second", default=5)
     parser.add_argument("-d", "--duration", type=int, help="Duration (in seconds)", default=10)
+    parser.add_argument(
+        "--warmup",
+        type=str,
+        help="auto: run at full load from the start and drop the requests sent before latency settled (asyncio engine only). "
+        "fixed: warm up at half load for half the duration, up to 30 seconds, first. none: no warmup. "
+        "Defaults to auto with the asyncio engine and fixed with vegeta",
+        default=None,
+        choices=WARMUP_MODES,
+    )
     parser.add_argument("-t", "--timeout", type=int, help="Timeout (in miliseconds)", default=5000)
-    parser.add_argument("-s", "--service", type=str, help="Feature Service", default=req_filenames[0], choices=req_filenames)
+    parser.add_argument(
+        "-s",
+        "--service",
+        type=str,
+        help=f"Request file to send, or the feature service with --synthesize. Request files: {', '.join(req_filenames) or 'none'}",
+        default=None,
+    )
     parser.add_argument("-f", "--file", help=f"If set, output to a file in {VEGET_OUT_FOLDERNAME}", action="store_true", default=False)
+    parser.add_argument(
+        "--out-dir",
+        type=Path,
+        help=f"Directory for --file and --results outputs, instead of {VEGET_OUT_FOLDERNAME}, e.g. to keep one campaign's runs together",
+        default=None,
+    )
+    parser.add_argument(
+        "-e",
+        "--engine",
+        type=str,
+        help="Load engine: shell out to vegeta, or use the built-in asyncio engine (no external binary)",
+        default="vegeta",
+        choices=ENGINES,
+    )
+    parser.add_argument(
+        "-w",
+        "--workers",
+        type=int,
+        help="Number of load-generating processes to split the RPS across (asyncio engine only)",
+        default=1,
+    )
+    parser.add_argument(
+        "--corpus",
+        type=str,
+        help="With multiple workers, whether each one cycles through all requests or only its own slice of them",
+        default="shared",
+        choices=["shared", "partitioned"],
+    )
+    parser.add_argument(
+        "-c",
+        "--concurrency",
+        type=int,
+        help="Closed loop: number of virtual users, each sending its next request once the previous one returns. Replaces --rps",
+        default=0,
+    )
+    parser.add_argument(
+        "--think-time",
+        type=int,
+        help="Closed loop: pause (in miliseconds) between a user's response and its next request (asyncio engine only)",
+        default=0,
+    )
+    parser.add_argument("--max-workers", type=int, help="Maximum number of requests in flight", default=20000)
+    parser.add_argument(
+        "--max-conns",
+        type=int,
+        help="Maximum connections per target host (0 for no limit)",
+        default=0,
+    )
+    parser.add_argument(
+        "--keepalive",
+        help="Reuse connections across requests",
+        action=argparse.BooleanOptionalAction,
+        default=True,
+    )
+    parser.add_argument(
+        "--idle-timeout",
+        type=float,
+        help="Close connections idle for this many seconds (asyncio engine only, default 90)",
+        default=None,
+    )
+    parser.add_argument(
+        "--http",
+        type=str,
+        help="HTTP version to use. Vegeta defaults to HTTP/2 where the server supports it, the asyncio engine to HTTP/1.1",
+        default=None,
+        choices=HTTP_VERSIONS,
+    )
+    parser.add_argument(
+        "-p",
+        "--profile",
+        type=str,
+        help="Multi-stage load profile replacing --rps, --duration and the warmup (see below)",
+        default=None,
+    )
+    parser.add_argument(
+        "--arrival",
+        type=str,
+        help="Open loop: spacing between requests. Constant gaps, exponential gaps (poisson) or bursts of --burst-size requests at once (asyncio engine only for the latter two)",
+        default="constant",
+        choices=ARRIVALS,
+    )
+    parser.add_argument("--burst-size", type=int, help="Requests per burst with --arrival=burst", default=10)
+    parser.add_argument(
+        "--seed",
+        type=int,
+        help="Random seed for --arrival=poisson/burst, --send-order and the join keys --synthesize draws (random if not set)",
+        default=None,
+    )
+    parser.add_argument(
+        "--synthesize",
+        type=str,
+        nargs=2,
+        metavar=("CLUSTER_URL", "WORKSPACE"),
+        help="Build each request as it's sent, with join keys picked as set by the options below, instead of reading a request file (asyncio engine only)",
+        default=None,
+    )
+    add_key_arguments(parser)
+    parser.add_argument(
+        "--prewarm",
+        type=int,
+        help="Connections to open per target host before sending load (asyncio engine only)",
+        default=None,
+    )
+    parser.add_argument(
+        "--replay",
+        type=str,
+        nargs=3,
+        metavar=("TRACE", "CLUSTER_URL", "WORKSPACE"),
+        help="Resend the requests logged in a JSON-lines trace at their recorded times, against WORKSPACE, instead of --rps and the warmup (asyncio engine only). With --service, only that service's requests",
+        default=None,
+    )
+    parser.add_argument(
+        "--send-order",
+        type=str,
+        help="Order the requests in the file are sent in: as written, a seeded shuffle, or interleaved so that consecutive requests are far apart in the file (asyncio engine only)",
+        default="sequential",
+        choices=ORDERS,
+    )
+    parser.add_argument(
+        "--results",
+        help=f"Also save every request's raw result: as records in {VEGET_OUT_FOLDERNAME}/<file>{RESULTS_SUFFIX} ({VEGETA_SUFFIX} with vegeta), for analyze_results.py, or as columns in {VEGET_OUT_FOLDERNAME}/<file>{COLUMNS_SUFFIX}, for analyze_columns.py",
+        nargs="?",
+        const="records",
+        default=None,
+        choices=["records", "columns"],
+    )
+    parser.add_argument("--time-scale", type=float, help="With --replay, replay this many times faster than recorded", default=1.0)
     args = parser.parse_args()
+    if args.replay is not None:
+        if args.engine != "asyncio":
+            raise Exception("--replay requires --engine=asyncio")
+        if args.synthesize is not None or args.profile is not None or args.concurrency:
+            raise Exception("--replay sends the trace's own requests on its own schedule: drop --synthesize, --profile and --concurrency")
+        if args.corpus == "partitioned":
+            raise Exception("--replay splits the trace between workers itself, so --corpus=partitioned doesn't apply")
+        if args.time_scale <= 0:
+            raise Exception("--time-scale must be positive")
+    elif args.synthesize is None:
+        if len(req_filenames) == 0:
+            raise Exception(f"No request files in {REQS_DIR}. Run `gen_requests.py` first.")
+        if args.service is None:
+            args.service = req_filenames[0]
+        elif args.service not in req_filenames:
+            raise Exception(f"No request file '{args.service}' in {REQS_DIR}, expected one of {req_filenames}")
+    else:
+        if args.service is None:
+            raise Exception("--synthesize needs the feature service to send requests to, set with --service")
+        if args.engine != "asyncio":
+            raise Exception("--synthesize requires --engine=asyncio")
+        if args.corpus == "partitioned":
+            raise Exception("--synthesize draws every worker's keys from one sequence, so --corpus=partitioned doesn't apply")
+    if args.warmup is None:
+        args.warmup = "auto" if args.engine == "asyncio" else "fixed"
+    elif args.warmup == "auto" and args.engine != "asyncio":
+        raise Exception("--warmup=auto requires --engine=asyncio")
+    if args.workers < 1:
+        raise Exception("--workers must be at least 1")
+    if args.workers > 1 and args.engine != "asyncio":
+        raise Exception("--workers requires --engine=asyncio")
+    profile = parse_profile(args.profile) if args.profile else None
+    if profile is not None and args.concurrency:
+        raise Exception("--profile describes open-loop load and can't be combined with --concurrency")
+    if profile is not None and args.engine == "vegeta" and not profile.piecewise_constant:
+        raise Exception("Vegeta only sends constant rates: ramp and sine profiles require --engine=asyncio")
+    if args.arrival != "constant" and args.concurrency:
+        raise Exception("--arrival applies to open-loop load and can't be combined with --concurrency")
+    if args.arrival != "constant" and args.engine != "asyncio":
+        raise Exception(f"--arrival={args.arrival} requires --engine=asyncio")
+    if args.burst_size < 1:
+        raise Exception("--burst-size must be at least 1")
+    seed = args.seed if args.seed is not None else random.randrange(2**32)
+    arrivals = ArrivalProcess(args.arrival, args.burst_size, seed)
+    if args.arrival != "constant":
+        print(f"Arrivals: {arrivals.describe()}")
+    if args.send_order != "sequential" and (args.engine != "asyncio" or args.replay is not None):
+        raise Exception("--send-order requires --engine=asyncio and a request file or --synthesize. Use gen_requests.py --order to reorder vegeta's requests")
+    order = Ordering(args.send_order, seed)
+    if args.send_order != "sequential":
+        print(f"Send order: {order.describe()}")
+    if args.think_time and not args.concurrency:
+        raise Exception("--think-time requires --concurrency")
+    if args.think_time and args.engine != "asyncio":
+        raise Exception("--think-time requires --engine=asyncio")
+    if (args.idle_timeout is not None or args.prewarm is not None) and args.engine != "asyncio":
+        raise Exception("--idle-timeout and --prewarm require --engine=asyncio")
+    pool_config = PoolConfig(
+        max_conns_per_host=args.max_conns,
+        idle_timeout=args.idle_timeout if args.idle_timeout is not None else PoolConfig.idle_timeout,
+        keepalive=args.keepalive,
+        prewarm=args.prewarm or 0,
+        http2=args.http == "2",
+    )
+    if pool_config.http2 and not pool_config.keepalive:
+        raise Exception("--no-keepalive doesn't apply to HTTP/2, which multiplexes requests over long-lived connections")
+    if pool_config.prewarm and pool_config.max_conns_per_host and pool_config.prewarm > pool_config.max_conns_per_host:
+        raise Exception(f"--prewarm {pool_config.prewarm} opens more connections than --max-conns {pool_config.max_conns_per_host} allows")
+    if pool_config.prewarm and not pool_config.keepalive:
+        raise Exception("--prewarm needs keep-alive: with --no-keepalive the prewarmed connections would be closed unused")
+    # Keep HTTP/1.1 and HTTP/2 results for the same service side by side instead of overwriting each other
+    out_name = str(args.service) if args.http is None else f"{args.service}_http{args.http}"
 
     # Check for API key
     api_key = ReqUtil._tecton_api_key()
 
-    # Check for vegeta
-    returncode, _, stderr = ReqUtil.shell_capture(["vegeta", "--version"])
-    if returncode != 0 or len(stderr) > 0:
-        raise Exception("Make sure Vegeta is installed. See https://github.com/tsenart/vegeta")
+    out_dir = args.out_dir if args.out_dir is not None else VEGETA_OUT_DIR
+    if args.file or args.results:
+        out_dir.mkdir(parents=True, exist_ok=True)
+
+    def out_file(name: str) -> Optional[Path]:
+        return out_dir / name if args.file else None
+
+    # With --file, each run also leaves its histograms in <file>.hist, for merge_histograms.py
+    labels = {"service": args.service or "", "host": socket.gethostname(), "engine": args.engine}
+
+    def result_log(name: str, phase: str) -> Optional[ResultLog]:
+        if args.results == "columns":
+            return ResultLog(out_dir / f"{name}{COLUMNS_SUFFIX}", name, "columns", {**labels, "phase": phase})
+        return ResultLog(out_dir / f"{name}{RESULTS_SUFFIX}", name) if args.results else None
+
+    def write_histograms(name: str, phase: str, stages: List[AttackStats]) -> None:
+        if args.file:
+            wall_offset = time.time() - time.monotonic()
+            records = [HistogramRecord.from_stats(stats, {**labels, "run": name, "phase": phase}, wall_offset) for stats in stages]
+            write_histogram_file(out_dir / f"{name}{HISTOGRAM_SUFFIX}", records)
+
+    if args.replay is not None:
+        trace, cluster_url, ws_name = args.replay
+        replay = Replay(Path(trace), args.time_scale, args.service)
+        corpus = TraceCorpus(post_origin(api_url(cluster_url), request_headers(api_key, pool_config)), ws_name)
+        print(f"Replaying {replay.describe()}...")
+        name = f"{Path(trace).stem}_replay"
+        stages = asyncio_phase(
+            corpus,
+            Load(0, replay=replay),
+            args.timeout,
+            out_file(name),
+            args.max_workers,
+            pool_config,
+            args.workers,
+            False,
+            result_log(name, "replay"),
+        )
+        write_histograms(name, "replay", stages)
+        print(f"Done replaying {trace}!")
+        return
 
     req_file = REQS_DIR / args.service
+    if args.synthesize is not None:
+        corpus = synthesized_corpus(args, seed, request_headers(api_key, pool_config))
+    elif args.engine == "vegeta":
+        if is_target_file(req_file):
+            raise Exception(f"{args.service} is a binary target file, which only --engine=asyncio reads")
+        # Check for vegeta
+        returncode, _, stderr = ReqUtil.shell_capture(["vegeta", "--version"])
+        if returncode != 0 or len(stderr) > 0:
+            raise Exception("Make sure Vegeta is installed. See https://github.com/tsenart/vegeta")
+    else:
+        # Decoded and encoded once up front, then shared by every phase
+        corpus = load_corpus(req_file, request_headers(api_key, pool_config))
+
+    def run_phase(load: Load, name: str, phase: str, stage: str = "") -> None:
+        if args.engine == "vegeta":
+            results_file = None
+            if args.results == "records":
+                results_file = out_dir / f"{name}{VEGETA_SUFFIX}"
+            elif args.file or args.results:
+                # Only kept until its histograms and columns are written
+                results_file = out_dir / f".{name}{VEGETA_SUFFIX}.tmp"
+            vegeta_phase(req_file, api_key, load, args.timeout, out_file(name), args.max_workers, pool_config, args.http, results_file)
+            if args.file:
+                records = records_from_results(iter_results(results_file), {**labels, "run": name, "phase": phase, "stage": stage})
+                write_histogram_file(out_dir / f"{name}{HISTOGRAM_SUFFIX}", records)
+            if args.results == "columns":
+                writer = result_log(name, phase).open([stage])
+                try:
+                    for result in iter_results(results_file):
+                        writer.add(result)
+                finally:
+                    writer.close()
+            if results_file is not None and args.results != "records":
+                results_file.unlink()
+        else:
+            stages = asyncio_phase(
+                corpus,
+                load,
+                args.timeout,
+                out_file(name),
+                args.max_workers,
+                pool_config,
+                args.workers,
+                args.corpus == "partitioned",
+                result_log(name, phase),
+            )
+            write_histograms(name, phase, stages)
+
+    if profile is not None:
+        print(f"Sending {len(profile.stages)}-stage load profile to {args.service} over {profile.duration:g} seconds...")
+        if args.engine == "asyncio":
+            # One continuous schedule, with each stage's results reported separately
+            run_phase(Load(profile.duration, profile=profile, arrivals=arrivals, order=order), out_name, "load")
+        else:
+            for i, stage in enumerate(profile.stages):
+                print(f"\nStage {stage.name}")
+                if stage.start_rate == 0:
+                    # Vegeta treats a zero rate as unlimited
+                    time.sleep(stage.duration)
+                    continue
+                run_phase(Load(stage.duration, rate=stage.start_rate), f"{out_name}_stage{i + 1}", "load", stage.name)
+        print(f"Done running {ENGINE_NAMES[args.engine]} against {args.service}!")
+        return
 
     # Warm up first
-    warmup_rps = args.rps // 2
-    warmup_duration = min(args.duration // 2, 30)
-    print(f"Warming up with {warmup_rps} RPS for {warmup_duration} seconds...")
-    cmd_attack_warmup = [
-        "vegeta",
-        "attack",
-        "--format=json",
-        f"--targets={req_file}",
-        f"--timeout={args.timeout}ms",
-        f"--rate={warmup_rps}/1s",
-        "--max-workers=20000",
-        f"--duration={warmup_duration}s",
-        f"--header=Authorization: Tecton-key {api_key}",
-    ]
-    cmd_report_warmup = [
-        "vegeta",
-        "report",
-        "--every=1s",
-    ]
-    if args.file:
-        VEGETA_OUT_DIR.mkdir(parents=True, exist_ok=True)
-        out_file = VEGETA_OUT_DIR / f"{str(args.service)}_WARMUP"
-        cmd_report_warmup.append(f"--output={out_file}")
-    ReqUtil.shell_pipe(cmd_attack_warmup, cmd_report_warmup)
+    if args.warmup == "fixed":
+        warmup_duration = min(args.duration // 2, 30)
+        if args.concurrency:
+            warmup = Load(warmup_duration, users=max(args.concurrency // 2, 1), think_time=args.think_time / 1000, order=order)
+            print(f"Warming up with {warmup.users} concurrent users for {warmup_duration} seconds...")
+        else:
+            warmup = Load(warmup_duration, rate=args.rps / 2, arrivals=arrivals, order=order)
+            print(f"Warming up with {warmup.rate:g} RPS for {warmup_duration} seconds...")
+        run_phase(warmup, f"{out_name}_WARMUP", "warmup", "" if args.concurrency else f"const {warmup.rate:g}rps")
+        print()
 
     # Then do full load
-    print(f"\nNow sending full load to {args.service}...")
-    cmd_attack = [
-        "vegeta",
-        "attack",
-        "--format=json",
-        f"--targets={req_file}",
-        f"--timeout={args.timeout}ms",
-        f"--rate={args.rps}/1s",
-        "--max-workers=20000",
-        f"--duration={args.duration}s",
-        f"--header=Authorization: Tecton-key {api_key}",
-    ]
-    cmd_report = [
-        "vegeta",
-        "report",
-        "--every=1s",
-    ]
-    if args.file:
-        VEGETA_OUT_DIR.mkdir(parents=True, exist_ok=True)
-        out_file = VEGETA_OUT_DIR / str(args.service)
-        cmd_report.append(f"--output={out_file}")
-
-    ReqUtil.shell_pipe(cmd_attack, cmd_report)
+    if args.warmup == "auto":
+        print(f"Sending full load to {args.service}, leaving out the warmup detected in its latencies...")
+    else:
+        print(f"Now sending full load to {args.service}...")
+    full_load = Load(
+        args.duration,
+        rate=args.rps,
+        users=args.concurrency,
+        think_time=args.think_time / 1000,
+        arrivals=arrivals,
+        order=order,
+        detect_warmup=args.warmup == "auto",
+    )
+    run_phase(full_load, out_name, "load", "" if args.concurrency else f"const {full_load.rate}rps")
 
-    print(f"Done running Vegeta against {args.service}!")
+    print(f"Done running {ENGINE_NAMES[args.engine]} against {args.service}!")
 
 
 if __name__ == '__main__':
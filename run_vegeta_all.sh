@@ -5,10 +5,17 @@
 # or just as a reference to paste line(s) into your console.
 #
 
-./run_vegeta.py --service fs_mixed_5_feature_views --file -r 5 -d 10 -t 5000 &
-./run_vegeta.py --service fs_mixed_10_feature_views --file -r 5 -d 10 -t 5000 &
-./run_vegeta.py --service fs_mixed_18_feature_views --file -r 5 -d 10 -t 5000 &
-./run_vegeta.py --service fs_non_aggregate_1_feature_views --file -r 5 -d 10 -t 5000 &
-./run_vegeta.py --service fs_non_aggregate_2_feature_views --file -r 5 -d 10 -t 5000 &
-./run_vegeta.py --service fs_non_aggregate_4_feature_views --file -r 5 -d 10 -t 5000 &
+# Each invocation writes to a directory of its own, so that the merge below only sees its runs
+OUT_DIR=vegeta_out/run_$(date +%Y%m%d_%H%M%S)
 
+./run_vegeta.py --service fs_mixed_5_feature_views --file --out-dir "$OUT_DIR" -r 5 -d 10 -t 5000 &
+./run_vegeta.py --service fs_mixed_10_feature_views --file --out-dir "$OUT_DIR" -r 5 -d 10 -t 5000 &
+./run_vegeta.py --service fs_mixed_18_feature_views --file --out-dir "$OUT_DIR" -r 5 -d 10 -t 5000 &
+./run_vegeta.py --service fs_non_aggregate_1_feature_views --file --out-dir "$OUT_DIR" -r 5 -d 10 -t 5000 &
+./run_vegeta.py --service fs_non_aggregate_2_feature_views --file --out-dir "$OUT_DIR" -r 5 -d 10 -t 5000 &
+./run_vegeta.py --service fs_non_aggregate_4_feature_views --file --out-dir "$OUT_DIR" -r 5 -d 10 -t 5000 &
+
+
+# Once they're all done, combine their histograms into exact aggregate percentiles
+wait
+./merge_histograms.py "$OUT_DIR"/*.hist --by phase
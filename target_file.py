@@ -0,0 +1,153 @@
+from array import array
+import itertools
+import json
+import mmap
+import os
+from pathlib import Path
+import re
+import sys
+from typing import Any, Callable, Dict, Iterable, List, Sequence
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Binary target file layout:
+#   MAGIC, then the header length as a little-endian uint32, then the JSON header, zero-padded
+#   to a multiple of 4 bytes, then the join-key values of every request as little-endian uint32s
+#   (zstd-compressed if the header says so). Request i's values fill the template's slots in order.
+MAGIC = b"BTGT\x01"
+SUFFIX = ".tgt"
+CHUNK_REQUESTS = 65536  # requests packed per write
+
+# Stands in for slot i while building a template: JSON-escaped control characters never occur in
+# the real bodies
+_SLOT_MARK = "\x01{}\x01"
+_SLOT_PATTERN = re.compile(r"\\u0001\d+\\u0001")
+
+
+def require_zstandard() -> None:
+    if zstandard is None:
+        raise Exception("Compressed target files need the `zstandard` package. Install it with `pip install zstandard`")
+
+
+class BodyTemplate:
+    # A request body with its join-key values cut out: parts[0] value[0] parts[1] ... parts[n]
+    def __init__(self, parts: List[bytes]):
+        self.parts = parts
+        self.slots = len(parts) - 1
+
+    @staticmethod
+    def from_params(build: Callable[[Iterable[str]], Dict[str, Any]], slots: int) -> "BodyTemplate":
+        # build gets one placeholder string per slot and returns the params to JSON-encode,
+        # e.g. lambda values: req_params(fs_name, ws_name, dict(zip(join_keys, values)))
+        text = json.dumps(build(_SLOT_MARK.format(i) for i in range(slots)))
+        parts = _SLOT_PATTERN.split(text)
+        if len(parts) != slots + 1:
+            raise Exception(f"Expected {slots} join-key slots in the request body, found {len(parts) - 1}")
+        return BodyTemplate([part.encode("utf-8") for part in parts])
+
+    def render(self, values: Sequence[int]) -> bytes:
+        parts = self.parts
+        out = [parts[0]]
+        for i, value in enumerate(values, 1):
+            out.append(b"%d" % value)
+            out.append(parts[i])
+        return b"".join(out)
+
+
+def is_target_file(path: Path) -> bool:
+    with open(path, "rb") as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+
+def write_target_file(
+    path: Path,
+    method: str,
+    url: str,
+    template: BodyTemplate,
+    join_keys: List[str],
+    keys_per_request: int,
+    count: int,
+    key_values: Iterable[Sequence[int]],
+    compress: bool = False,
+) -> int:
+    # key_values yields one flat sequence of template.slots values per request. Written to a
+    # hidden temporary file and moved into place, like the JSON request files.
+    if compress:
+        require_zstandard()
+    header = json.dumps({
+        "method": method,
+        "url": url,
+        "parts": [part.decode("utf-8") for part in template.parts],
+        "join_keys": join_keys,
+        "keys_per_request": keys_per_request,
+        "count": count,
+        "compression": "zstd" if compress else None,
+    }).encode("utf-8")
+    header += b"\0" * (-(len(MAGIC) + 4 + len(header)) % 4)
+    written = 0
+    tmp_path = path.with_name(f".{path.name}.tmp")
+    with open(tmp_path, "wb") as f:
+        f.write(MAGIC + len(header).to_bytes(4, "little") + header)
+        out = zstandard.ZstdCompressor().stream_writer(f, size=count * template.slots * 4, closefd=False) if compress else f
+        key_values = iter(key_values)
+        while True:
+            values = array("I")
+            for request in itertools.islice(key_values, CHUNK_REQUESTS):
+                values.extend(request)
+                written += 1
+            if not values:
+                break
+            if sys.byteorder == "big":
+                values.byteswap()
+            out.write(values.tobytes())
+        if compress:
+            out.close()
+    if written != count:
+        os.remove(tmp_path)
+        raise Exception(f"Header promises {count} requests, got {written}")
+    os.replace(tmp_path, path)
+    return written
+
+
+class TargetFile:
+    # Memory-mapped reader: the header is parsed once, then request i's body is rendered from
+    # the template and the i-th run of packed values, without reading the rest of the file
+    def __init__(self, path: Path):
+        with open(path, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._mmap[:len(MAGIC)] != MAGIC:
+            raise Exception(f"{path} is not a binary target file")
+        header_len = int.from_bytes(self._mmap[len(MAGIC):len(MAGIC) + 4], "little")
+        offset = len(MAGIC) + 4
+        header = json.loads(self._mmap[offset:offset + header_len].rstrip(b"\0"))
+        self.method: str = header["method"]
+        self.url: str = header["url"]
+        self.template = BodyTemplate([part.encode("utf-8") for part in header["parts"]])
+        self.join_keys: List[str] = header["join_keys"]
+        self.keys_per_request: int = header["keys_per_request"]
+        self.count: int = header["count"]
+        payload = memoryview(self._mmap)[offset + header_len:]
+        if header["compression"] == "zstd":
+            require_zstandard()
+            payload = memoryview(
+                zstandard.ZstdDecompressor().decompress(payload, max_output_size=self.count * self.template.slots * 4)
+            )
+        if sys.byteorder == "big":
+            swapped = array("I")
+            swapped.frombytes(payload)
+            swapped.byteswap()
+            payload = memoryview(swapped).cast("B")
+        self._values = payload.cast("I")
+
+    def __len__(self) -> int:
+        return self.count
+
+    def key_values(self, index: int) -> memoryview:
+        slots = self.template.slots
+        return self._values[index * slots:(index + 1) * slots]
+
+    def body(self, index: int) -> bytes:
+        return self.template.render(self.key_values(index))
@@ -0,0 +1,50 @@
+import random
+import unittest
+
+from histogram import Histogram, quantile_test
+
+N = 5000
+
+
+def sample(seed: int, n: int = N, slow_fraction: float = 0.0, slowdown: float = 1.0, shift: float = 1.0) -> Histogram:
+    # Lognormal latencies around 5ms, in µs, with slow_fraction of them slowdown times slower
+    rng = random.Random(seed)
+    hist = Histogram()
+    for _ in range(n):
+        value = rng.lognormvariate(8.5, 0.3) * shift
+        if rng.random() < slow_fraction:
+            value *= slowdown
+        hist.record(int(value))
+    return hist
+
+
+class QuantileTestTest(unittest.TestCase):
+    def test_tail_regression(self):
+        # 1% of requests 3x slower: p99 roughly doubles, p50 doesn't move
+        baseline, candidate = sample(1), sample(2, slow_fraction=0.01, slowdown=3)
+        self.assertLess(quantile_test(baseline, candidate, 99), 0.01)
+        self.assertGreater(quantile_test(baseline, candidate, 50), 0.01)
+
+    def test_body_regression(self):
+        baseline, candidate = sample(1), sample(2, shift=1.1)
+        self.assertLess(quantile_test(baseline, candidate, 50), 0.01)
+
+    def test_same_distribution(self):
+        # p-values of runs without a regression are roughly uniform
+        p_values = [quantile_test(sample(2 * i), sample(2 * i + 1), 99) for i in range(40)]
+        self.assertLessEqual(sum(p < 0.05 for p in p_values), 6)
+        self.assertGreater(min(p_values), 1e-4)
+
+    def test_one_sided(self):
+        baseline, candidate = sample(1, slow_fraction=0.01, slowdown=3), sample(2)
+        self.assertGreater(quantile_test(baseline, candidate, 99), 0.5)
+
+    def test_empty_and_constant(self):
+        constant = Histogram()
+        constant.record(1000, N)
+        self.assertEqual(quantile_test(Histogram(), sample(1), 99), 1.0)
+        self.assertEqual(quantile_test(constant, constant, 99), 1.0)
+
+
+if __name__ == "__main__":
+    unittest.main()
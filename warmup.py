@@ -0,0 +1,95 @@
+from collections import Counter
+import math
+from typing import Dict, List, Optional, Tuple
+
+from histogram import Histogram
+
+# Automatic warmup detection. Instead of a fixed warmup phase ahead of the measured one, the
+# load runs at full rate from the start, and the requests sent before latency settled are
+# dropped from the results afterwards. The cut is chosen by MSER (the Marginal Standard Error
+# Rule, White 1997) over the mean latency of each interval: the truncation point that
+# minimizes the standard error of the mean of what's left, searched over the first half of
+# the run. A minimum at the end of that range means latency never settled.
+WARMUP_MODES = ["auto", "fixed", "none"]
+INTERVAL = 1.0  # seconds per observation
+MIN_INTERVALS = 10  # below this, warmup can't be told apart from noise
+
+
+def mser(values: List[float]) -> Optional[int]:
+    # How many leading values to drop, or None if the series hadn't settled by its midpoint
+    n = len(values)
+    if n < MIN_INTERVALS:
+        return None
+    half = n // 2
+    best, cut = math.inf, half
+    total = sum_sq = 0.0
+    # Walks backwards, so ties go to the smallest cut
+    for d in range(n - 1, -1, -1):
+        total += values[d]
+        sum_sq += values[d] * values[d]
+        if d <= half:
+            m = n - d
+            stat = (sum_sq - total * total / m) / (m * m)
+            if stat <= best:
+                best, cut = stat, d
+    return None if cut == half else cut
+
+
+class Interval:
+    # The part of AttackStats that warmup detection trims, for the requests sent in one interval
+    def __init__(self):
+        self.latencies = Histogram()
+        self.corrected = Histogram()
+        self.status_codes: Counter = Counter()
+        self.success = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.first_sent = math.inf
+
+    def merge(self, other: "Interval") -> None:
+        self.latencies.merge(other.latencies)
+        self.corrected.merge(other.corrected)
+        self.status_codes.update(other.status_codes)
+        self.success += other.success
+        self.bytes_in += other.bytes_in
+        self.bytes_out += other.bytes_out
+        self.first_sent = min(self.first_sent, other.first_sent)
+
+
+class Timeline:
+    def __init__(self):
+        # Keyed by send time (on the monotonic clock, which worker processes share) // INTERVAL
+        self.intervals: Dict[int, Interval] = {}
+
+    def add(self, sent: float, latency: int, corrected: int, status: int, bytes_in: int, bytes_out: int) -> None:
+        key = int(sent // INTERVAL)
+        interval = self.intervals.get(key)
+        if interval is None:
+            interval = self.intervals[key] = Interval()
+        interval.latencies.record(latency)
+        interval.corrected.record(corrected)
+        interval.status_codes[status] += 1
+        if 200 <= status < 400:
+            interval.success += 1
+        interval.bytes_in += bytes_in
+        interval.bytes_out += bytes_out
+        interval.first_sent = min(interval.first_sent, sent)
+
+    def merge(self, other: "Timeline") -> None:
+        for key, other_interval in other.intervals.items():
+            interval = self.intervals.get(key)
+            if interval is None:
+                interval = self.intervals[key] = Interval()
+            interval.merge(other_interval)
+
+    def split(self) -> Optional[Tuple[Interval, Interval]]:
+        # The warmup and steady-state requests, or None if latency didn't settle. Intervals
+        # nothing was sent in (e.g. all users thinking) are skipped.
+        keys = sorted(self.intervals)
+        cut = mser([self.intervals[key].latencies.mean() for key in keys])
+        if cut is None:
+            return None
+        warmup, steady = Interval(), Interval()
+        for i, key in enumerate(keys):
+            (warmup if i < cut else steady).merge(self.intervals[key])
+        return warmup, steady